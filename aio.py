@@ -0,0 +1,55 @@
+import asyncio
+import contextvars
+import threading
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """
+    Return the process-wide event loop, started in a daemon thread on first use.
+
+    Every request's Places and Gemini I/O runs as coroutines on this one loop,
+    so the async HTTP clients keep their connection pools across requests and
+    a request waiting on the network holds no pool thread.
+    """
+    global _loop
+
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='aio-loop', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+async def _in_context(awaitable, context):
+    # Tasks on the loop start from the loop thread's context; carry over the
+    # caller's context vars (e.g. the request's timing spans) instead.
+    for var, value in context.items():
+        var.set(value)
+    return await awaitable
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the shared loop from sync code and return its result."""
+    context = contextvars.copy_context()
+    return asyncio.run_coroutine_threadsafe(_in_context(coro, context), get_loop()).result(timeout)
+
+
+def iterate(agen):
+    """Iterate an async generator on the shared loop from sync code (e.g. a Flask streaming response)."""
+    loop = get_loop()
+    context = contextvars.copy_context()
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(_in_context(agen.__anext__(), context), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
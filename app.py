@@ -1,17 +1,48 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template, session
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, send_from_directory, render_template, session, stream_with_context, g
 from flask_cors import CORS
 import utils
+import aio
+import score_grid
+import intent
+import semantic_cache
+import metrics
+import traffic
 import os
+import json
+import asyncio
+import threading
 from dotenv import load_dotenv
 
 
-from google import genai
-# api_key = os.getenv('google_llm_api')
-client = genai.Client()
-
 # Load environment variables
 load_dotenv()
 
+# The GenAI client is created on first use, not at import: google.genai is
+# by far the slowest import here, and workers serving only /health or static
+# files never need it.
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide GenAI client, creating it on first use (wrapped for TRAFFIC_MODE)."""
+    global client
+
+    if client is None:
+        with _client_lock:
+            if client is None:
+                if traffic.replaying():
+                    # Answers come from the recording; no key or network needed
+                    client = traffic.wrap_genai(None)
+                else:
+                    from google import genai
+                    # api_key = os.getenv('google_llm_api')
+                    client = traffic.wrap_genai(genai.Client())
+    return client
+
 app = Flask(__name__, template_folder='.', static_folder='.')
 app.secret_key = os.getenv('SECRET_KEY')  # Add to .env file
 
@@ -39,113 +70,224 @@ def serve_index():
 
 
 
-# Add a health check endpoint
-@app.route('/health')
-def health_check():
-    return jsonify({"status": "healthy", "message": "Flask server is running"})
+@app.before_request
+def start_timing():
+    g.metrics_token = metrics.start_request()
+    g.started = time.perf_counter()
 
 
+@app.after_request
+def add_timing(response):
+    """Record the request in /metrics and send its per-stage breakdown as a Server-Timing header."""
+    token = g.pop('metrics_token', None)
+    if token is None:
+        return response
 
-@app.route("/chat", methods=["POST"])
-def chat():
+    elapsed = time.perf_counter() - g.started
+    spans = metrics.end_request(token)
+    endpoint = request.endpoint or 'unknown'
+    metrics.request_seconds.observe(elapsed, endpoint=endpoint)
+    metrics.requests_total.inc(endpoint=endpoint, status=response.status_code)
+    # Streamed bodies are produced after this runs, so only the work done so far is in the header
+    response.headers['Server-Timing'] = metrics.server_timing(spans, total=elapsed)
+    return response
 
-    # global current_location, chat_history
 
-    try:
-        data = request.get_json()
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint. Numbers are per worker process."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-        if not data:
-            return jsonify({"error": "No JSON data received"}), 400
-        
-        lat = data.get("lat")
-        lng = data.get("lng")
-        
-        print('data:')
-        print(data)
 
-        print('lat', 'lng:')
-        print(lat, lng)
+# Add a health check endpoint
+@app.route('/health')
+def health_check():
+    return jsonify({"status": "healthy", "message": "Flask server is running"})
 
-        if lat == None:
-            # Get current stored location
-            lat = current_location.get('lat') or session.get('lat')
-            lng = current_location.get('lng') or session.get('lng')
 
-        print('lat', 'lng:')
-        print(lat, lng)
+def warm_up():
+    """
+    Create what the first chat or click would otherwise set up on its
+    request: the GenAI client, both Places clients, the aio loop and the
+    score grid. Safe to call more than once.
+    """
+    started = time.perf_counter()
+    get_client()
+    utils.get_places_client()
+    utils.get_async_places_client()
+    aio.get_loop()
+    score_grid.get_score_grid()
+    print(f"Warm-up done in {(time.perf_counter() - started) * 1000:.0f} ms")
 
-        
-        if not data:
-            return jsonify({"error": "No JSON data received"}), 400
-        
-        message = data.get("message")
-        # chat_history = str(chat_history['chat_history']) + \
-            # "message: "+ message + '\n'
-        
-        if not message:
-            return jsonify({"error": "No message provided"}), 400
-        
-        print(f"Received chat message: {message}")
-        
-        # Your chat logic here - for now it's a mirror response
-        # You can add AI/chatbot logic here later
-        if message.lower() == "hi":
-            response_text = "Hi! How can I help you today?"
-        elif message.lower() in ["hello", "hey"]:
-            response_text = "Hello there! What would you like to know?"
-        elif "location" in message.lower():
-            response_text = "Click on the map to get location scores and information!"
-        elif "help" in message.lower():
-            response_text = "I can help you with location information. Try clicking on the map or asking about specific areas!"
-        else:
 
-            if lat == None:
-                response_text = 'Please select a location on Map and Ask again.'
-            else:
-        #       agent 0, understand if user is looking for information
-                response0 = utils.ask_google_maps_or_not(client, message)
-                print('response0: ', response0)
+# Warm-up hook: point a startup probe (or App Engine warmup requests) here
+@app.route('/_ah/warmup')
+def warmup():
+    warm_up()
+    return jsonify({"status": "warm"})
 
-                if 'yes' in response0.lower():
-        #       agent 1, reframe the question to be asked to google maps
-                    response1 = utils.rephrase_ques_for_maps(client, message)
-                    keyword1 = response1.split('**')[0]
-                    keyword1 = keyword1.replace('**', '')
 
-                    if keyword1.strip() == '':
-                        keyword1 = response1.split('**')[1]
-                        keyword1 = keyword1.replace('**', '')
 
-                    if keyword1.strip() == '':
-                        keyword1 = response1.split('**')[2]
-                        keyword1 = keyword1.replace('**', '')
+async def _cached_answer(client, message, lat, lng):
+    """
+    Look the message up in the answer cache. Returns (embedding, answer):
+    answer is None on a miss, and both are None if the embeddings call fails.
+    """
+    try:
+        with metrics.span('embed'):
+            embedding = await semantic_cache.embed_text_async(client, message)
+    except Exception as e:
+        print(f"Embedding failed, skipping the answer cache: {e}")
+        return None, None
+
+    with metrics.span('answer_cache_lookup'):
+        cached_answer, similarity = semantic_cache.answer_cache.lookup(embedding, lat, lng)
+    metrics.count_lookup('answer', cached_answer is not None)
+    print('answer cache similarity: ', round(similarity, 3))
+    return embedding, cached_answer
+
+
+def _chat_request():
+    """Read message, lat and lng from a chat request. Returns (message, lat, lng, error_response)."""
+    data = request.get_json()
+
+    if not data:
+        return None, None, None, (jsonify({"error": "No JSON data received"}), 400)
+
+    lat = data.get("lat")
+    lng = data.get("lng")
+
+    if lat == None:
+        # Get current stored location
+        lat = current_location.get('lat') or session.get('lat')
+        lng = current_location.get('lng') or session.get('lng')
+
+    print('lat', 'lng:')
+    print(lat, lng)
+
+    message = data.get("message")
+    # chat_history = str(chat_history['chat_history']) + \
+        # "message: "+ message + '\n'
+
+    if not message:
+        return None, None, None, (jsonify({"error": "No message provided"}), 400)
+
+    print(f"Received chat message: {message}")
+    return message, lat, lng, None
+
+
+async def chat_events(message, lat, lng, stream=False):
+    """
+    Run the chat agents for one message, yielding (kind, text) events:
+    "status" while the planning agent and the Places search run, "token" chunks
+    of the final answer when stream is set, and one "response" with the
+    full answer at the end.
+
+    This is an async generator: its LLM and Places calls run on the shared
+    aio loop, so waiting on them holds no thread. Iterate it from a route
+    with aio.iterate.
+    """
+
+    # Your chat logic here - for now it's a mirror response
+    # You can add AI/chatbot logic here later
+    if message.lower() == "hi":
+        yield "response", "Hi! How can I help you today?"
+    elif message.lower() in ["hello", "hey"]:
+        yield "response", "Hello there! What would you like to know?"
+    elif "location" in message.lower():
+        yield "response", "Click on the map to get location scores and information!"
+    elif "help" in message.lower():
+        yield "response", "I can help you with location information. Try clicking on the map or asking about specific areas!"
+    elif lat == None:
+        yield "response", 'Please select a location on Map and Ask again.'
+    else:
+        client = get_client()
+
+        # A close enough question already answered near here skips the rest of
+        # the agents. The lookup (an embeddings call) runs while the plan and
+        # the Places search go ahead, so a cache miss, most messages, costs
+        # no extra round trip; a hit still answers as soon as it is known.
+        lookup_task = asyncio.create_task(_cached_answer(client, message, lat, lng))
+        plan_task = search_task = None
+        try:
+#           agents 0 and 1: does the user need maps information, and what to search.
+#           Obvious place searches are matched locally; the rest ask the LLM in one call
+            keyword1, confidence = intent.match_intent(message)
+            if confidence >= intent.CONFIDENCE_THRESHOLD:
+                plan = utils.MapsPlan(needs_maps=True, keyword=keyword1)
+            else:
+                plan_task = asyncio.create_task(utils.plan_maps_query_async(client, message))
+                yield "status", "Understanding your question..."
+                await asyncio.wait({lookup_task, plan_task}, return_when=asyncio.FIRST_COMPLETED)
+                if lookup_task.done() and lookup_task.result()[1] is not None:
+                    yield "response", lookup_task.result()[1]
+                    return
+                plan = await plan_task
+            print('plan: ', plan, 'intent confidence: ', confidence)
+
+            if plan.needs_maps:
+                keyword1 = plan.keyword
+
+                # search keyword1 on google maps, only as far as the context needs
+                yield "status", f"Searching places for {keyword1}..."
+                api_key = os.getenv('google_place_api_key')
+                search_task = asyncio.create_task(utils.search_places_async(
+                    keyword1, lat, lng, 1, api_key, max_pages=3, max_results=utils.CHAT_CONTEXT_PLACES))
+
+            embedding, cached_answer = await lookup_task
+            if cached_answer is not None:
+                yield "response", cached_answer
+                return
+
+            if plan.needs_maps:
+                places, response_json = await search_task
+                print(f"places: {len(places)} for {keyword1!r}, status {response_json.get('status')}")
+
+                context = utils.formalize_context(places)
+
+#               agent 2, generate answer from google maps results
+                yield "status", "Writing the answer..."
+                if stream:
+                    chunks = []
+                    async for chunk in utils.respond_to_maps_output_stream_async(client, message, context):
+                        chunks.append(chunk)
+                        yield "token", chunk
+                    response_final = ''.join(chunks)
+                else:
+                    response_final = await utils.respond_to_maps_output_async(client, message, context)
 
+                if embedding is not None:
+                    semantic_cache.answer_cache.add(embedding, lat, lng, message, response_final)
 
-                    print('response1: ', response1)
-                    print('keyword1: ', keyword1)
+                # LLM Answer
+                yield "response", response_final
 
+            else:
+                yield "response", plan.answer
+        finally:
+            # A cache hit, an error or a client gone away: drop the unfinished calls
+            for task in (lookup_task, plan_task, search_task):
+                if task is not None and not task.done():
+                    task.cancel()
 
-                    # search response1 on google maps
-                    api_key = os.getenv('google_place_api_key')
-                    places, response_json = utils.search_places(keyword1, lat, lng, 1, api_key, max_pages=3)
-                    print('places: ', str(places)[:150], '\n\n')
-                    print('response_json: ', str(response_json)[:150], '\n\n')
+    # chat_history = str(chat_history['chat_history']) + \
+        # "response: "+ response_text + '\n'
 
-                    context = utils.formalize_context(places)
-                    print('context`: ', context)
 
-        #           agent 2, generate answer from google maps results 
-                    response_final = utils.respond_to_maps_output(client, message, context)
+@app.route("/chat", methods=["POST"])
+def chat():
 
-                    # LLM Answer
-                    response_text = response_final
-                
-                else:
-                    response_text = response0
+    # global current_location, chat_history
 
-        # chat_history = str(chat_history['chat_history']) + \
-            # "response: "+ response_text + '\n'
+    try:
+        message, lat, lng, error_response = _chat_request()
+        if error_response:
+            return error_response
 
+        response_text = ''
+        for kind, text in aio.iterate(chat_events(message, lat, lng)):
+            if kind == "response":
+                response_text = text
 
         return jsonify({
             "response": response_text,
@@ -160,6 +302,49 @@ def chat():
         }), 500
 
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Streaming version of /chat over Server-Sent Events: "status" events
+    while the agents and Places search run, "token" events with answer text
+    as it is generated, then "done" with the full response (or "error").
+    """
+    message, lat, lng, error_response = _chat_request()
+    if error_response:
+        return error_response
+
+    def event(name, payload):
+        return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+    def generate():
+        try:
+            streamed = False
+            for kind, text in aio.iterate(chat_events(message, lat, lng, stream=True)):
+                if kind == "status":
+                    yield event("status", {"message": text})
+                elif kind == "token":
+                    streamed = True
+                    yield event("token", {"text": text})
+                else:
+                    if not streamed:
+                        yield event("token", {"text": text})
+                    yield event("done", {"response": text, "status": "success"})
+        except Exception as e:
+            print(f"Error in chat stream: {e}")
+            yield event("error", {"error": f"Server error: {str(e)}", "status": "error"})
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _valid_coordinates(lat, lng):
+    """True for numeric lat/lng within range. bool is an int subclass; true/false are not coordinates."""
+    for value in (lat, lng):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return False
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+
 @app.route("/process-coordinates", methods=["POST"])
 def process_coordinates():
     
@@ -169,7 +354,7 @@ def process_coordinates():
         # Get JSON data from request
         data = request.get_json()
         
-        if not data:
+        if not data or not isinstance(data, dict):
             return jsonify({"error": "No JSON data received"}), 400
         
         lat = data.get("lat")
@@ -180,8 +365,8 @@ def process_coordinates():
             return jsonify({"error": "Missing lat or lng coordinates"}), 400
         
         
-        # Validate coordinate ranges
-        if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        # Validate coordinate types and ranges
+        if not _valid_coordinates(lat, lng):
             return jsonify({"error": "Invalid coordinate values"}), 400
         
 
@@ -198,9 +383,15 @@ def process_coordinates():
         # print('Processing coordinates...')
         # print(result)
         
-        # Get scores using your utils function
+        # Get scores from the precomputed grid, or live with your utils function
         try:
-            scores, top_places, top_ratings = utils.get_all_scores(lat, lng)
+            grid = score_grid.get_score_grid()
+            with metrics.span('score_grid_lookup'):
+                grid_scores = grid.lookup(lat, lng) if grid is not None else None
+            if grid_scores is not None:
+                scores, top_places, top_ratings = grid_scores
+            else:
+                scores, top_places, top_ratings = aio.run(utils.get_all_scores_async(lat, lng))
             print("Scores:", scores)
             
             # Return both the message and the scores
@@ -234,6 +425,136 @@ def process_coordinates():
         }), 200  # Changed from 500 to 200
     
 
+@app.route("/process-coordinates/stream", methods=["GET", "POST"])
+def process_coordinates_stream():
+    """
+    Server-Sent Events version of /process-coordinates. Takes lat/lng as
+    query parameters (for EventSource) or as a JSON body, then sends one
+    "category" event per category as soon as it is scored, followed by a
+    "summary" event shaped like the /process-coordinates response.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object with lat and lng"}), 400
+    lat = data.get("lat", request.args.get("lat", type=float))
+    lng = data.get("lng", request.args.get("lng", type=float))
+
+    # Validate coordinates
+    if lat is None or lng is None:
+        return jsonify({"error": "Missing lat or lng coordinates"}), 400
+    if not _valid_coordinates(lat, lng):
+        return jsonify({"error": "Invalid coordinate values"}), 400
+
+    # Store current location
+    current_location['lat'] = lat
+    current_location['lng'] = lng
+    session['lat'] = lat
+    session['lng'] = lng
+
+    def event(name, payload):
+        return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+    def generate():
+        scores, top_places, top_ratings = {}, {}, {}
+        try:
+            grid = score_grid.get_score_grid()
+            grid_scores = grid.lookup(lat, lng) if grid is not None else None
+            if grid_scores is not None:
+                results = ((c, [grid_scores[0][c], grid_scores[1][c], grid_scores[2][c]]) for c in grid_scores[0])
+            else:
+                results = utils.iter_scores(lat, lng)
+
+            for category, (score, top_place, top_rating) in results:
+                scores[category] = score
+                top_places[category] = top_place
+                top_ratings[category] = top_rating
+                yield event("category", {"category": category, "score": score,
+                                         "name": top_place, "top_rating": top_rating})
+
+            status = "success"
+            error = None
+        except Exception as e:
+            print(f"Error in utils.iter_scores: {e}")
+            status = "partial_success"
+            error = f"Error calculating scores: {str(e)}"
+
+        summary = {"message": '',
+                   "coordinates": {"lat": lat, "lng": lng},
+                   "scores": scores,
+                   "names": top_places,
+                   "top_ratings": top_ratings,
+                   "status": status}
+        if error:
+            summary["error"] = error
+        yield event("summary", summary)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/process-coordinates/batch", methods=["POST"])
+def process_coordinates_batch():
+    """
+    Score many points in one call. Body: {"points": [{"lat": .., "lng": ..}, ...]}.
+    Streams one JSON object per line, per point, in completion order; each
+    carries the point's "index" in the request.
+    """
+    data = request.get_json(silent=True)
+
+    if not isinstance(data, dict) or not isinstance(data.get("points"), list):
+        return jsonify({"error": "Expected JSON with a 'points' list"}), 400
+
+    points = data["points"]
+    max_points = int(os.getenv('BATCH_MAX_POINTS', '1000'))
+    if len(points) > max_points:
+        return jsonify({"error": f"At most {max_points} points per batch"}), 400
+
+    grid = score_grid.get_score_grid()
+    valid = []
+    early = []
+    for index, point in enumerate(points):
+        lat = point.get("lat") if isinstance(point, dict) else None
+        lng = point.get("lng") if isinstance(point, dict) else None
+        if not _valid_coordinates(lat, lng):
+            early.append({"index": index, "error": "Invalid or missing lat/lng", "status": "error"})
+            continue
+
+        grid_scores = grid.lookup(lat, lng) if grid is not None else None
+        if grid_scores is not None:
+            early.append(_batch_result(index, lat, lng, grid_scores))
+        else:
+            valid.append((index, lat, lng))
+
+    def generate():
+        for line in early:
+            yield json.dumps(line) + "\n"
+
+        results = utils.get_scores_batch([(lat, lng) for _, lat, lng in valid],
+                                         max_workers=int(os.getenv('BATCH_MAX_WORKERS', '8')))
+        for i, result, error in results:
+            index, lat, lng = valid[i]
+            if error is not None:
+                line = {"index": index, "coordinates": {"lat": lat, "lng": lng},
+                        "error": f"Error calculating scores: {str(error)}", "status": "error"}
+            else:
+                line = _batch_result(index, lat, lng, result)
+            yield json.dumps(line) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _batch_result(index, lat, lng, result):
+    scores, top_places, top_ratings = result
+    return {"index": index,
+            "coordinates": {"lat": lat, "lng": lng},
+            "scores": scores,
+            "names": top_places,
+            "top_ratings": top_ratings,
+            "status": "success"}
+    
+
 # Remove manual CORS headers since flask-cors handles this
 # @app.after_request
 # def after_request(response):
@@ -242,6 +563,16 @@ def process_coordinates():
 #     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
 #     return response
 
+# Set WARMUP_ON_START=1 to warm up in the background as soon as a worker has imported the app
+if os.getenv('WARMUP_ON_START', '') == '1':
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+_import_ms = (time.perf_counter() - _import_started) * 1000
+_import_budget_ms = float(os.getenv('IMPORT_TIME_BUDGET_MS', '1000'))
+print(f"app imported in {_import_ms:.0f} ms (budget {_import_budget_ms:.0f} ms)")
+if _import_ms > _import_budget_ms:
+    print("WARNING: app import is over budget; see `python -X importtime -c 'import app'` for the slow modules")
+
 if __name__ == "__main__":
     print("Starting Flask server...")
     print("Server will be available at: http://localhost:5000")
@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+# Bengaluru, where the app is used
+BBOX = (12.83, 77.46, 13.14, 77.78)
+
+CHAT_MESSAGES = ["cafes near me", "good coffee nearby", "any hospital close by", "gyms around here",
+                 "where can I get a haircut", "is there a metro station nearby", "best restaurants around",
+                 "where can my kids play", "a quiet place to study", "police station near me"]
+
+
+class FakePlacesServer:
+    """
+    Local stand-in for Places Text Search on http://127.0.0.1:<port>/.
+
+    Results are canned but stable per query and location: up to pages x 20
+    places around the requested location, ranked by distance like
+    rankby=distance. next_page_tokens behave like the real ones and answer
+    INVALID_REQUEST until token_delay seconds after they were issued. Every
+    response waits latency seconds (plus up to jitter), and calls are
+    counted.
+    """
+
+    def __init__(self, latency=0.15, jitter=0.05, token_delay=1.5, pages=3, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.pages = pages
+        self.calls = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                body = json.dumps(server.respond(params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/maps/api/place/textsearch/json"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fake-places', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def respond(self, params):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if 'pagetoken' in params:
+            token = json.loads(base64.urlsafe_b64decode(params['pagetoken']))
+            if time.time() < token['issued'] + self.token_delay:
+                return {"status": "INVALID_REQUEST", "results": []}
+            query, location, page = token['query'], token['location'], token['page']
+        else:
+            query, location, page = params.get('query', ''), params.get('location', '0,0'), 0
+
+        lat, lng = map(float, location.split(','))
+        seed = int(hashlib.md5(f"{query}|{lat:.3f}|{lng:.3f}".encode()).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        # Each query gets its own density: about how far apart (km) consecutive results are
+        spacing = rng.uniform(0.05, 0.6)
+        count = rng.randint(8, self.pages * 20)
+
+        results = []
+        for i in range(page * 20, min(count, (page + 1) * 20)):
+            place_rng = random.Random(seed + i)
+            distance = spacing * (i + place_rng.random())
+            bearing = place_rng.uniform(0, 2 * math.pi)
+            results.append({
+                "name": f"{query.title()} {i + 1}",
+                "formatted_address": f"{i + 1} Main Road, Bengaluru",
+                "geometry": {"location": {"lat": lat + distance / 111.32 * math.cos(bearing),
+                                          "lng": lng + distance / (111.32 * math.cos(math.radians(lat))) * math.sin(bearing)}},
+                "rating": round(place_rng.uniform(2.5, 5), 1),
+                "user_ratings_total": place_rng.randint(1, 3000),
+                "place_id": f"fake-{seed:08x}-{i}",
+            })
+
+        response = {"status": "OK" if results else "ZERO_RESULTS", "results": results}
+        if (page + 1) * 20 < count:
+            token = {'query': query, 'location': location, 'page': page + 1, 'issued': time.time()}
+            response["next_page_token"] = base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+        return response
+
+
+class _FakeText:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeEmbedding:
+    def __init__(self, values):
+        self.embeddings = [type('Embedding', (), {'values': values})()]
+
+
+def _fake_reply(contents, config=None):
+    message = contents.rsplit("Message: ", 1)[-1] if "Message: " in contents else ''
+    if config:
+        # plan_maps_query_async: plain questions get a keyword, the rest are answered directly
+        import intent
+        keyword, _ = intent.match_intent(message)
+        words = [w for w in re.sub(r"[^\w\s]", "", message.lower()).split() if w not in intent.filler_words]
+        keyword = keyword or (words[-1] if words else None)
+        if keyword:
+            return json.dumps({"needs_maps": True, "keyword": keyword})
+        return json.dumps({"needs_maps": False, "answer": "Could you tell me what you are looking for?"})
+    if contents.startswith("If the message"):
+        return "Yes"
+    if contents.startswith("Rephrase"):
+        return "**" + message.split()[-1] + "**"
+    names = re.findall(r"Name: \d+ (.*?)Type:", contents)[:2]
+    return "You could try " + " or ".join(names or ["a place nearby"]) + "."
+
+
+def _fake_embedding(text, dims=64):
+    values = [0.0] * dims
+    for word in re.sub(r"[^\w\s]", "", text.lower()).split():
+        values[int(hashlib.md5(word.encode()).hexdigest(), 16) % dims] += 1.0
+    return values
+
+
+class _FakeModels:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        self.owner.count()
+        time.sleep(self.owner.delay)
+        return _FakeText(_fake_reply(contents, config))
+
+    def generate_content_stream(self, model, contents, config=None):
+        self.owner.count()
+        words = _fake_reply(contents, config).split(' ')
+        for i, word in enumerate(words):
+            time.sleep(self.owner.delay / len(words))
+            yield _FakeText(word if i == 0 else ' ' + word)
+
+    def embed_content(self, model, contents, config=None):
+        self.owner.count()
+        time.sleep(self.owner.embed_delay)
+        return _FakeEmbedding(_fake_embedding(contents))
+
+
+class _FakeAsyncModels:
+    def __init__(self, owner):
+        self.owner = owner
+
+    async def generate_content(self, model, contents, config=None):
+        self.owner.count()
+        await asyncio.sleep(self.owner.delay)
+        return _FakeText(_fake_reply(contents, config))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        self.owner.count()
+
+        async def chunks():
+            words = _fake_reply(contents, config).split(' ')
+            for i, word in enumerate(words):
+                await asyncio.sleep(self.owner.delay / len(words))
+                yield _FakeText(word if i == 0 else ' ' + word)
+        return chunks()
+
+    async def embed_content(self, model, contents, config=None):
+        self.owner.count()
+        await asyncio.sleep(self.owner.embed_delay)
+        return _FakeEmbedding(_fake_embedding(contents))
+
+
+class FakeGenaiClient:
+    """
+    Stand-in for google.genai.Client: models.generate_content(_stream),
+    models.embed_content and their client.aio versions, each taking delay
+    (embed_delay for embeddings) seconds. Calls are counted.
+    """
+
+    def __init__(self, delay=0.8, embed_delay=0.05):
+        self.delay = delay
+        self.embed_delay = embed_delay
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.models = _FakeModels(self)
+        self.aio = type('AsyncClient', (), {})()
+        self.aio.models = _FakeAsyncModels(self)
+
+    def count(self):
+        with self._lock:
+            self.calls += 1
+
+
+def random_points(n, seed=0):
+    rng = random.Random(seed)
+    return [(rng.uniform(BBOX[0], BBOX[2]), rng.uniform(BBOX[1], BBOX[3])) for _ in range(n)]
+
+
+def run_scenario(name, calls, concurrency, places, llm):
+    """Run the callables with concurrency threads. Returns one row of the report."""
+    places_before, llm_before = places.calls, llm.calls
+    latencies = []
+    errors = 0
+
+    def timed(call):
+        started = time.perf_counter()
+        ok = call()
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed, ok in pool.map(timed, calls):
+            latencies.append(elapsed)
+            errors += 0 if ok else 1
+    wall = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1000
+    return {"scenario": name,
+            "requests": len(calls),
+            "concurrency": concurrency,
+            "errors": errors,
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+            "throughput_rps": round(len(calls) / wall, 2),
+            "places_calls_per_request": round((places.calls - places_before) / len(calls), 2),
+            "llm_calls_per_request": round((llm.calls - llm_before) / len(calls), 2)}
+
+
+def clear_caches():
+    import semantic_cache
+    import utils
+
+    utils.places_cache.clear()
+    if utils.place_index is not None:
+        utils.place_index.clear()
+    utils.llm_cache.clear()
+    semantic_cache.answer_cache.clear()
+
+
+def main(args):
+    places = FakePlacesServer(latency=args.places_latency / 1000, jitter=args.places_jitter / 1000,
+                              token_delay=args.token_delay).start()
+    llm = FakeGenaiClient(delay=args.llm_latency / 1000, embed_delay=args.embed_latency / 1000)
+
+    # Point everything at the stand-ins before the app is imported; no results persist between runs
+    # (--store puts the Places store and place index in a fresh SQLite file, so their cost is measured)
+    store_path = os.path.join(tempfile.mkdtemp(), 'places_cache.sqlite3') if args.store else ''
+    os.environ.update({'PLACES_TEXT_SEARCH_URL': places.url, 'google_place_api_key': 'benchmark',
+                       'PLACES_STORE_PATH': store_path,'LLM_STORE_PATH': '', 'SCORE_GRID_PATH': '',
+                       'PLACES_QPS': str(args.places_qps), 'PLACES_RATE_STATE': os.path.abspath('benchmark_ratelimit.json'),
+                       'SECRET_KEY': os.getenv('SECRET_KEY', 'benchmark')})
+
+    import app
+    import utils
+    app.client = llm
+
+    points = random_points(args.requests, seed=args.seed)
+    rng = random.Random(args.seed)
+    messages = [rng.choice(CHAT_MESSAGES) for _ in range(args.requests)]
+    local = threading.local()
+
+    def test_client():
+        if not hasattr(local, 'client'):
+            local.client = app.app.test_client()
+        return local.client
+
+    def score(lat, lng):
+        return lambda: utils.get_all_scores(lat, lng) is not None
+
+    def click(lat, lng):
+        return lambda: test_client().post('/process-coordinates', json={'lat': lat, 'lng': lng}).status_code == 200
+
+    def chat(message, lat, lng):
+        return lambda: test_client().post('/chat', json={'message': message, 'lat': lat, 'lng': lng}).status_code == 200
+
+    scenarios = {
+        'get_all_scores': [score(lat, lng) for lat, lng in points],
+        'process-coordinates': [click(lat, lng) for lat, lng in points],
+        'chat': [chat(m, lat, lng) for m, (lat, lng) in zip(messages, points)],
+    }
+
+    rows = []
+    for name in args.scenarios:
+        if not args.keep_caches:
+            clear_caches()
+        print(f"Running {name}: {args.requests} requests, concurrency {args.concurrency}...")
+        # The app logs with print; keep it out of the report unless asked for
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+            rows.append(run_scenario(name, scenarios[name], args.concurrency, places, llm))
+
+    places.stop()
+
+    columns = ["scenario", "requests", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput_rps",
+               "places_calls_per_request", "llm_calls_per_request"]
+    print()
+    widths = [max(len(c), *(len(str(row[c])) for row in rows)) for c in columns]
+    print("  ".join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(columns, widths))))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(w) if i == 0 else str(row[c]).rjust(w)
+                        for i, (c, w) in enumerate(zip(columns, widths))))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"settings": vars(args), "results": rows}, f, indent=2)
+        print(f"Wrote {args.json}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark scoring and chat against local stand-ins for Places and Gemini.")
+    parser.add_argument("--scenarios", nargs="+", choices=["get_all_scores", "process-coordinates", "chat"],
+                        default=["get_all_scores", "process-coordinates", "chat"])
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--places-latency", type=float, default=150, help="Places response time in ms")
+    parser.add_argument("--places-jitter", type=float, default=50, help="Extra random Places delay, up to this many ms")
+    parser.add_argument("--token-delay", type=float, default=1.5, help="Seconds before a next_page_token works")
+    parser.add_argument("--llm-latency", type=float, default=800, help="Gemini generate_content time in ms")
+    parser.add_argument("--embed-latency", type=float, default=50, help="Gemini embed_content time in ms")
+    parser.add_argument("--places-qps", type=float, default=0, help="Places rate limit to apply (0: off)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for points and messages")
+    parser.add_argument("--store", action="store_true", help="Enable the SQLite Places store, in a fresh temp file")
+    parser.add_argument("--keep-caches", action="store_true", help="Don't clear in-memory caches between scenarios")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own log output")
+    main(parser.parse_args())
@@ -0,0 +1,117 @@
+import os
+import re
+
+from utils import normalize_query, query_dict
+
+
+# Messages matching at or above this confidence skip the LLM planning call.
+CONFIDENCE_THRESHOLD = float(os.getenv('INTENT_CONFIDENCE', '0.8'))
+
+# Extra phrasings for the searches in query_dict, mapped to the normalized
+# query they should run. Keywords for query_dict entries are added
+# automatically, so only add words people use that are not in there.
+synonyms = {'hotel': 'hotels', 'lodge': 'hotels', 'stay': 'hotels', 'hostel': 'hotels',
+            'police': 'police stations', 'police station': 'police stations',
+            'bus': 'bus stop', 'bus stand': 'bus stop', 'bus stops': 'bus stop',
+            'metro': 'metro station', 'metro stations': 'metro station',
+            'train': 'train station', 'railway station': 'train station', 'railway': 'train station',
+            'hospital': 'hospitals', 'clinic': 'hospitals', 'doctor': 'hospitals',
+            'cafe': 'cafes', 'coffee': 'cafes', 'coffee shop': 'cafes', 'coffee shops': 'cafes',
+            'restaurant': 'restaurants', 'food': 'restaurants', 'eat': 'restaurants',
+            'gym': 'gyms', 'fitness centre': 'gyms', 'fitness center': 'gyms',
+            'movie': 'movie theaters', 'movies': 'movie theaters', 'cinema': 'movie theaters',
+            'theatre': 'movie theaters', 'theater': 'movie theaters',
+            'club': 'clubs', 'pub': 'clubs', 'pubs': 'clubs', 'bar': 'clubs', 'bars': 'clubs',
+            'school': 'schools', 'college': 'colleges', 'university': 'universities',
+            'park': 'parks', 'walking trail': 'walking trails',
+            'temple': 'religious place', 'church': 'religious place', 'mosque': 'religious place',
+            'museums': 'museum', 'art galleries': 'art gallery',
+            'coworking': 'coworking spaces', 'coworking space': 'coworking spaces',
+            'tech park': 'tech parks', 'office': 'offices', 'factory': 'factories'}
+
+# Words that only say "find it near here" and don't change what to search.
+filler_words = {'a', 'an', 'the', 'me', 'my', 'i', 'is', 'are', 'there', 'any', 'some', 'by', 'for',
+                'of', 'to', 'in', 'at', 'here', 'this', 'area', 'place', 'places', 'please', 'show',
+                'find', 'where', 'wheres', 'which', 'whats', 'what', 'good', 'best', 'nice', 'top',
+                'near', 'nearby', 'nearest', 'close', 'closest', 'around', 'within', 'walking',
+                'distance', 'can', 'get', 'go', 'want', 'need', 'looking', 'list', 'options'}
+
+
+def _trigrams(text):
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _build_index():
+    phrases = {}
+    for queries in query_dict.values():
+        if type(queries) == str:
+            queries = [queries]
+        for query_str in queries:
+            keyword = normalize_query(query_str)
+            phrases[keyword] = keyword
+    for phrase, keyword in synonyms.items():
+        phrases[phrase] = keyword
+
+    trigram_index = {}
+    for phrase in phrases:
+        for trigram in _trigrams(phrase):
+            trigram_index.setdefault(trigram, set()).add(phrase)
+    return phrases, trigram_index
+
+_phrases, _trigram_index = _build_index()
+
+
+def _best_phrase(ngram):
+    """(phrase, similarity) for the closest known phrase, by exact match or trigram overlap."""
+    if ngram in _phrases:
+        return ngram, 1.0
+
+    grams = _trigrams(ngram)
+    candidates = set()
+    for trigram in grams:
+        candidates |= _trigram_index.get(trigram, set())
+
+    best, best_score = None, 0.0
+    for phrase in candidates:
+        phrase_grams = _trigrams(phrase)
+        score = len(grams & phrase_grams) / len(grams | phrase_grams)
+        if score > best_score:
+            best, best_score = phrase, score
+    return best, best_score
+
+
+def match_intent(message):
+    """
+    Match a chat message against the search vocabulary.
+
+    The best matching phrase of up to three words is weighted by how much of
+    the message it, together with filler words, explains. "cafes near me" or
+    "any hospital close by" score close to 1; anything asking more than
+    where something is scores low and should go to the LLM.
+
+    Returns:
+        (str | None, float): Search keyword and confidence in [0, 1].
+    """
+    words = re.sub(r"[^\w\s]", "", message.lower()).split()
+    if not words:
+        return None, 0.0
+
+    best = None, 0.0, 0
+    for size in (3, 2, 1):
+        for start in range(len(words) - size + 1):
+            ngram = " ".join(words[start:start + size])
+            phrase, score = _best_phrase(ngram)
+            if phrase and score > best[1] and score >= 0.5:
+                best = phrase, score, (start, start + size)
+
+    phrase, score, span = best
+    if phrase is None:
+        return None, 0.0
+
+    explained = span[1] - span[0]
+    for i, word in enumerate(words):
+        if not span[0] <= i < span[1] and word in filler_words:
+            explained += 1
+
+    return _phrases[phrase], score * explained / len(words)
@@ -0,0 +1,157 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Seconds. Covers cache hits (well under 1ms) up to slow page-token chains.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_str(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Counter:
+    """Monotonic counter with labels, in Prometheus text format."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, in Prometheus text format."""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_label_str(key)} {series[-1]}")
+        return lines
+
+
+stage_seconds = Histogram('agenticai_stage_duration_seconds',
+                          'Time spent in one stage of a request (LLM agent, Places page, scorer, cache lookup).')
+stage_errors = Counter('agenticai_stage_errors_total', 'Stages that raised an exception.')
+request_seconds = Histogram('agenticai_request_duration_seconds',
+                            'Time to produce a response, per endpoint (streamed bodies excluded).')
+requests_total = Counter('agenticai_requests_total', 'Responses sent, per endpoint and status code.')
+cache_lookups = Counter('agenticai_cache_lookups_total', 'Cache lookups, per cache and result.')
+
+_registry = [stage_seconds, stage_errors, request_seconds, requests_total, cache_lookups]
+
+
+def register(*new_metrics):
+    """Add metrics defined elsewhere to /metrics."""
+    _registry.extend(new_metrics)
+
+
+# (stage, seconds) spans of the request being served, or None outside a request.
+# A contextvar, so spans from the aio loop and the places pool land on the
+# request that started them (aio.py and utils copy the context over).
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Time the enclosed block as one stage: observed in stage_seconds under
+    the stage name and labels, and added to the current request's breakdown.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=stage, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage, **labels)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def count_lookup(cache, hit):
+    cache_lookups.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def start_request():
+    """Start collecting spans for the current request. Returns a token for end_request."""
+    return _request_spans.set([])
+
+
+def end_request(token):
+    """Stop collecting spans and return them as (stage, seconds) pairs."""
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing(spans, total=None):
+    """Server-Timing header value: total milliseconds and call count per stage, slowest first."""
+    totals = {}
+    for stage, elapsed in spans:
+        duration, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (duration + elapsed, count + 1)
+
+    parts = [f'{stage};dur={duration * 1000:.1f};desc="{count}x"'
+             for stage, (duration, count) in sorted(totals.items(), key=lambda item: -item[1][0])]
+    if total is not None:
+        parts.insert(0, f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,293 @@
+import atexit
+import math
+import threading
+import time
+
+import numpy as np
+
+from cache import geohash_encode, haversine_np
+
+
+class _Cell:
+    """One geohash bucket: query -> {place key: [lat, lng, record, fetched_at]} and query -> {origin: search}."""
+
+    __slots__ = ('lock', 'places', 'searches', 'loaded_at', 'evicted')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.places = {}
+        self.searches = {}
+        self.loaded_at = 0.0
+        self.evicted = False  # dropped from the index; add() must fetch the cell again
+
+    def empty(self):
+        return not any(self.places.values()) and not any(self.searches.values())
+
+
+class PlaceIndex:
+    """
+    Spatial index of every place fetched from the Places API, bucketed by
+    geohash cell and deduplicated by place_id.
+
+    Each place is filed under the (normalized) queries that returned it, and
+    each search's origin is remembered, so later requests can ask for the k
+    nearest places of a query around a point without calling the API. A
+    search covers the area out to the farthest place it fetched (all of it
+    once the API has no more pages). A lookup only answers within what a
+    fresh search made close by covered, and only when enough fresh places
+    are in range; entries older than max_age are ignored and dropped.
+
+    Places are kept as opaque records (a list from Place.to_record()). With
+    a store, each place and search is one row, keyed by cell, query and
+    place, so workers never overwrite each other's rows. Rows are written by
+    a background thread every flush_interval seconds, off the request path,
+    and cells are re-read from the store after refresh seconds to pick up
+    the other workers' places.
+
+    Only cells holding places or searches are kept in memory. Lookups never
+    create cells; cells found empty in the store are remembered (up to
+    max_empty of them) so they are not scanned again until refresh, and
+    cells whose entries have all expired are dropped.
+
+    Parameters:
+        precision (int): Geohash precision of the buckets (5 is about 4.9km x 4.9km).
+        max_age (float): Seconds a place or search stays fresh.
+        store (ResultStore): Optional persistent layer.
+        refresh (float): Seconds before a cell is read from the store again.
+        flush_interval (float): Seconds between background writes to the store.
+        max_empty (int): Empty store cells remembered between refreshes.
+    """
+
+    def __init__(self, precision=5, max_age=24 * 3600, store=None, refresh=60, flush_interval=1.0,
+                 max_empty=4096):
+        self.precision = precision
+        self.max_age = max_age
+        self.store = store
+        self.refresh = refresh
+        self.flush_interval = flush_interval
+        self.max_empty = max_empty
+        self._cells = {}
+        self._empty = {}  # cell hash -> when the store last had nothing for it
+        self._cells_lock = threading.Lock()
+        self._pending = {}  # store key -> row, written by the flusher
+        self._pending_lock = threading.Lock()
+        self._flusher = None
+
+        lat_bits = 5 * precision // 2
+        self._cell_height = 180.0 / 2 ** lat_bits
+        self._cell_width = 360.0 / 2 ** (5 * precision - lat_bits)
+
+    @staticmethod
+    def place_key(place_id, name, lat, lng):
+        """Dedup key: the place_id, or name and rounded position for records without one."""
+        return place_id or f"{name}@{lat:.5f},{lng:.5f}"
+
+    def _fresh(self, fetched_at, now):
+        return now - fetched_at <= self.max_age
+
+    # Store keys are "<cell>|<query>|p|<place key>" and "<cell>|<query>|s|<origin geohash>";
+    # normalize_query never leaves a "|" in a query.
+    def _load(self, cell_hash, cell, now):
+        for key, row in self.store.get_prefix(cell_hash + '|').items():
+            _, query, kind, item = key.split('|', 3)
+            group = cell.places if kind == 'p' else cell.searches
+            mine = group.setdefault(query, {}).get(item)
+            # row[3] / row[2] is when the place was fetched / the search made
+            at = 3 if kind == 'p' else 2
+            if self._fresh(row[at], now) and (mine is None or row[at] > mine[at]):
+                group[query][item] = row
+
+    def _cell(self, cell_hash, now, create=False):
+        """
+        The cell, pruned and read from the store when it is new or due a
+        refresh. Without create, None when neither memory nor the store has
+        anything in it.
+        """
+        cell = self._cells.get(cell_hash)
+        if cell is None:
+            if not create:
+                checked = self._empty.get(cell_hash)
+                if self.store is None or (checked is not None and now - checked <= self.refresh):
+                    return None
+            cell = _Cell()
+            if not create:
+                self._refresh(cell_hash, cell, now)
+                if cell.empty():
+                    with self._cells_lock:
+                        self._empty[cell_hash] = now
+                        while len(self._empty) > self.max_empty:
+                            del self._empty[next(iter(self._empty))]
+                    return None
+            with self._cells_lock:
+                self._empty.pop(cell_hash, None)
+                cell = self._cells.setdefault(cell_hash, cell)
+
+        if now - cell.loaded_at > self.refresh:
+            self._refresh(cell_hash, cell, now)
+            if not create and cell.empty():
+                with self._cells_lock, cell.lock:
+                    if cell.empty() and self._cells.get(cell_hash) is cell:
+                        del self._cells[cell_hash]
+                        cell.evicted = True
+                return None
+        return cell
+
+    def _refresh(self, cell_hash, cell, now):
+        with cell.lock:
+            if now - cell.loaded_at > self.refresh:
+                for group, at in ((cell.places, 3), (cell.searches, 2)):
+                    for query in list(group):
+                        group[query] = {k: v for k, v in group[query].items() if self._fresh(v[at], now)}
+                        if not group[query]:
+                            del group[query]
+                if self.store is not None:
+                    self._load(cell_hash, cell, now)
+                cell.loaded_at = now
+
+    def _cell_for_add(self, cell_hash, now):
+        """The cell, created if need be, returned with its lock held."""
+        while True:
+            cell = self._cell(cell_hash, now, create=True)
+            cell.lock.acquire()
+            if not cell.evicted:
+                return cell
+            cell.lock.release()
+
+    def _cells_within(self, lat, lng, radius_km):
+        """Geohashes of every cell overlapping the box around (lat, lng) that contains radius_km."""
+        d_lat = radius_km / 111.32
+        d_lng = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+        lats = np.append(np.arange(lat - d_lat, lat + d_lat, self._cell_height), lat + d_lat)
+        lngs = np.append(np.arange(lng - d_lng, lng + d_lng, self._cell_width), lng + d_lng)
+        return {geohash_encode(min(max(a, -90.0), 89.999999), (b + 180.0) % 360.0 - 180.0, self.precision)
+                for a in lats for b in lngs}
+
+    def add(self, query, origin_lat, origin_lng, places, reach_km=None):
+        """
+        Add the places one search returned and remember where it was made.
+
+        Parameters:
+            query (str): Normalized query the places were found for.
+            origin_lat (float), origin_lng (float): Where the search was centred.
+            places (list): (place_id, name, lat, lng, record) tuples.
+            reach_km (float): How far from the origin the search covered, None if complete.
+        """
+        now = time.time()
+        rows = {}
+
+        by_cell = {}
+        for place_id, name, lat, lng, record in places:
+            if lat is not None and lng is not None:
+                by_cell.setdefault(geohash_encode(lat, lng, self.precision), []).append(
+                    (self.place_key(place_id, name, lat, lng), [lat, lng, record, now]))
+        for cell_hash, items in by_cell.items():
+            cell = self._cell_for_add(cell_hash, now)
+            try:
+                bucket = cell.places.setdefault(query, {})
+                for key, row in items:
+                    bucket[key] = row
+                    rows[f"{cell_hash}|{query}|p|{key}"] = row
+            finally:
+                cell.lock.release()
+
+        origin_cell = geohash_encode(origin_lat, origin_lng, self.precision)
+        origin = geohash_encode(origin_lat, origin_lng, 8)
+        search = [origin_lat, origin_lng, now, reach_km]
+        cell = self._cell_for_add(origin_cell, now)
+        try:
+            cell.searches.setdefault(query, {})[origin] = search
+        finally:
+            cell.lock.release()
+        rows[f"{origin_cell}|{query}|s|{origin}"] = search
+
+        if self.store is not None:
+            self._queue(rows)
+
+    def _queue(self, rows):
+        with self._pending_lock:
+            self._pending.update(rows)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='place-index-flush', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write the rows added since the last flush to the store."""
+        with self._pending_lock:
+            rows, self._pending = self._pending, {}
+        if rows:
+            self.store.set_many(rows, ttl=self.max_age)
+
+    def nearest(self, query, lat, lng, k=20, radius_km=5.0):
+        """
+        The k nearest fresh places tagged with query within radius_km of
+        (lat, lng), as (distance km, record) pairs, nearest first.
+        """
+        now = time.time()
+        rows = []
+        for cell_hash in self._cells_within(lat, lng, radius_km):
+            cell = self._cell(cell_hash, now)
+            if cell is None:
+                continue
+            with cell.lock:
+                rows.extend(cell.places.get(query, {}).values())
+        rows = [row for row in rows if self._fresh(row[3], now)]
+
+        if not rows:
+            return []
+        dists = haversine_np(lat, lng, np.array([row[0] for row in rows], dtype=float),
+                              np.array([row[1] for row in rows], dtype=float))
+        order = [i for i in np.argsort(dists, kind='stable') if dists[i] <= radius_km][:k]
+        return [(float(dists[i]), rows[i][2]) for i in order]
+
+    def covered_radius(self, query, lat, lng, within_km):
+        """
+        Radius in km around (lat, lng) covered by fresh searches for query
+        centred within within_km of it (inf if one was complete, 0 if none).
+        """
+        now = time.time()
+        covered = 0.0
+        for cell_hash in self._cells_within(lat, lng, within_km):
+            cell = self._cell(cell_hash, now)
+            if cell is None:
+                continue
+            with cell.lock:
+                searches = list(cell.searches.get(query, {}).values())
+            for s_lat, s_lng, searched_at, reach_km in searches:
+                if not self._fresh(searched_at, now):
+                    continue
+                offset = float(haversine_np(lat, lng, s_lat, s_lng))
+                if offset <= within_km:
+                    covered = max(covered, math.inf if reach_km is None else reach_km - offset)
+        return covered
+
+    def lookup(self, query, lat, lng, k, radius_km, min_places, search_km):
+        """
+        nearest(), or None when local coverage is too thin or stale to stand in
+        for an API search: fewer than min_places fresh places within the part
+        of radius_km covered by fresh searches centred within search_km.
+        """
+        radius_km = min(radius_km, self.covered_radius(query, lat, lng, search_km))
+        if radius_km <= 0:
+            return None
+        found = self.nearest(query, lat, lng, k=max(k, min_places), radius_km=radius_km)
+        if len(found) < min_places:
+            return None
+        return found[:k]
+
+    def clear(self):
+        with self._cells_lock:
+            self._cells.clear()
+            self._empty.clear()
+
+    def stats(self):
+        with self._cells_lock:
+            cells = list(self._cells.values())
+        places = sum(len(bucket) for cell in cells for bucket in cell.places.values())
+        searches = sum(len(bucket) for cell in cells for bucket in cell.searches.values())
+        return {'cells': len(cells), 'places': places, 'searches': searches}
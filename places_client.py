@@ -0,0 +1,227 @@
+import asyncio
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+import traffic
+from ratelimit import get_rate_limiter
+
+
+TEXT_SEARCH_URL = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+
+
+class RetryableHTTPError(Exception):
+    """Raised for Places responses worth retrying (5xx, 429)."""
+
+
+class OverQueryLimit(RetryableHTTPError):
+    """Places answered OVER_QUERY_LIMIT; retried, then raised instead of being read as no results."""
+
+
+def _check_quota(response_json):
+    if response_json.get("status") == "OVER_QUERY_LIMIT":
+        raise OverQueryLimit(f"Places API returned OVER_QUERY_LIMIT: {response_json.get('error_message', '')}")
+    return response_json
+
+
+def _page_token_polls(first_delay, backoff, max_wait):
+    """
+    Polling schedule for a fresh page token, shared by both clients' text_search_page:
+    yields how long to sleep before each request, is sent its response, and
+    returns the first response that is not INVALID_REQUEST, or the last one
+    once max_wait seconds have been spent waiting.
+    """
+    delay = first_delay
+    waited = 0.0
+
+    while True:
+        response_json = yield delay
+        waited += delay
+        if response_json.get("status") != "INVALID_REQUEST" or waited >= max_wait:
+            return response_json
+
+        delay = min(delay * backoff, max_wait - waited)
+
+
+class PlacesClient:
+    """
+    Shared, keep-alive HTTP client for the Google Places API.
+
+    One requests.Session is reused for every call, so the TCP+TLS handshake to
+    maps.googleapis.com happens once per pooled connection instead of once per
+    request.
+
+    Parameters:
+        pool_size (int): Max connections kept alive to the Places host.
+        timeout (float | tuple): Per-call timeout in seconds, or (connect, read).
+        max_retries (int): Attempts per call for connection errors, timeouts and 5xx.
+        page_token_wait (float): Max seconds to poll a next_page_token before giving up.
+        url (str): Text Search endpoint (override to point at a local stand-in).
+    """
+
+    def __init__(self, pool_size=12, timeout=(3.05, 10), max_retries=3, page_token_wait=10, url=TEXT_SEARCH_URL):
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.page_token_wait = page_token_wait
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._get_json = retry(
+            reraise=True,
+            stop=stop_after_attempt(max_retries),
+            wait=wait_exponential(multiplier=0.2, max=2),
+            retry=retry_if_exception_type((requests.ConnectionError,
+                                           requests.Timeout,
+                                           RetryableHTTPError)),
+        )(self._get_json_once)
+
+    def _get_json_once(self, url, params, timeout):
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            limiter.acquire(params.get("key"))
+
+        response = self.session.get(url, params=params, timeout=timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableHTTPError(f"Places API returned HTTP {response.status_code}")
+        response.raise_for_status()
+        return _check_quota(response.json())
+
+    def text_search(self, params, timeout=None):
+        """
+        Call Places Text Search with the given query parameters.
+
+        Returns:
+            dict: Decoded JSON response.
+        """
+        return self._get_json(self.url, params, timeout or self.timeout)
+
+    def text_search_page(self, params, page_token, first_delay=0.4, backoff=1.6):
+        """
+        Fetch the page behind a next_page_token as soon as the token is live.
+
+        A fresh token is rejected with INVALID_REQUEST for a short, variable
+        time. Instead of a fixed sleep, poll with short exponential backoff
+        (0.4s, 0.64s, 1.02s, ...) and return the first response that is not
+        INVALID_REQUEST, giving up after page_token_wait seconds. Only the
+        calling query chain waits; other chains keep running in their threads.
+        """
+        params = dict(params, pagetoken=page_token)
+        polls = _page_token_polls(first_delay, backoff, self.page_token_wait)
+        try:
+            delay = next(polls)
+            while True:
+                time.sleep(delay)
+                delay = polls.send(self.text_search(params))
+        except StopIteration as done:
+            return done.value
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncPlacesClient:
+    """
+    PlacesClient for asyncio code, on one pooled httpx.AsyncClient.
+
+    Waiting for a page token or a slow response suspends only the calling
+    coroutine, so one event loop can keep many query chains in flight. The
+    client is bound to the event loop it is first used on (see aio.py).
+    Parameters are the same as PlacesClient.
+    """
+
+    def __init__(self, pool_size=12, timeout=(3.05, 10), max_retries=3, page_token_wait=10, url=TEXT_SEARCH_URL):
+        import httpx  # only needed once something goes async; keeps it out of worker start-up
+
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.page_token_wait = page_token_wait
+
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+        self._get_json = retry(
+            reraise=True,
+            stop=stop_after_attempt(max_retries),
+            wait=wait_exponential(multiplier=0.2, max=2),
+            retry=retry_if_exception_type((httpx.TransportError, RetryableHTTPError)),
+        )(self._get_json_once)
+
+    async def _get_json_once(self, url, params, timeout):
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            await limiter.acquire_async(params.get("key"))
+
+        response = await self.client.get(url, params=params, timeout=timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableHTTPError(f"Places API returned HTTP {response.status_code}")
+        response.raise_for_status()
+        return _check_quota(response.json())
+
+    async def text_search(self, params, timeout=None):
+        """Async PlacesClient.text_search."""
+        return await self._get_json(self.url, params, timeout or self.timeout)
+
+    async def text_search_page(self, params, page_token, first_delay=0.4, backoff=1.6):
+        """Async PlacesClient.text_search_page; polls with asyncio.sleep instead of blocking a thread."""
+        params = dict(params, pagetoken=page_token)
+        polls = _page_token_polls(first_delay, backoff, self.page_token_wait)
+        try:
+            delay = next(polls)
+            while True:
+                await asyncio.sleep(delay)
+                delay = polls.send(await self.text_search(params))
+        except StopIteration as done:
+            return done.value
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def _client_settings():
+    return dict(
+        pool_size=int(os.getenv('PLACES_POOL_SIZE', os.getenv('PLACES_MAX_CONCURRENCY', '12'))),
+        timeout=float(os.getenv('PLACES_TIMEOUT', '10')),
+        max_retries=int(os.getenv('PLACES_MAX_RETRIES', '3')),
+        page_token_wait=float(os.getenv('PLACES_PAGE_TOKEN_WAIT', '10')),
+        url=os.getenv('PLACES_TEXT_SEARCH_URL', TEXT_SEARCH_URL),
+    )
+
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def get_places_client():
+    """Return the process-wide PlacesClient, creating it on first use (wrapped for TRAFFIC_MODE)."""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = traffic.wrap_places(PlacesClient(**_client_settings()))
+    return _client
+
+
+def get_async_places_client():
+    """Return the process-wide AsyncPlacesClient, creating it on first use. Use it only on the aio.py loop."""
+    global _async_client
+
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = traffic.wrap_places(AsyncPlacesClient(**_client_settings()), async_client=True)
+    return _async_client
@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limiter is shared by this process's threads only
+    fcntl = None
+
+import metrics
+
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+# Who is asking: chat and map clicks are interactive, batch scoring and grid
+# builds are batch. A contextvar, so it follows work into the places pool
+# and the aio loop.
+priority = contextvars.ContextVar('places_priority', default=INTERACTIVE)
+
+wait_seconds = metrics.Histogram('agenticai_places_ratelimit_wait_seconds',
+                                 'Time Places calls waited for a rate limit token, per priority.')
+rejected = metrics.Counter('agenticai_places_ratelimit_rejected_total',
+                           'Places calls refused by the rate limiter, per priority and reason.')
+metrics.register(wait_seconds, rejected)
+
+
+class RateLimitError(Exception):
+    """A Places call was not sent: the daily budget is spent or the queue wait ran out."""
+
+
+@contextmanager
+def priority_scope(level):
+    """Run the enclosed block (and work it hands to pools) at the given priority."""
+    token = priority.set(level)
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+class RateLimiter:
+    """
+    Token bucket per API key, shared by every thread and gunicorn worker on
+    the machine through a small state file under an exclusive file lock.
+
+    Each key refills at qps tokens per second up to burst, and may spend
+    daily_budget calls per UTC day (0 for no limit). Batch callers leave
+    batch_reserve of the burst and of the daily budget untouched, so chat
+    and clicks still get through while a batch is running.
+
+    Parameters:
+        path (str): State file shared by the processes.
+        qps (float): Sustained calls per second per key.
+        burst (float): Bucket size.
+        daily_budget (int): Calls per key per day, 0 for unlimited.
+        batch_reserve (float): Fraction of burst and budget kept for interactive calls.
+        max_wait (float): Seconds a call may queue before RateLimitError.
+    """
+
+    def __init__(self, path, qps=50, burst=None, daily_budget=0, batch_reserve=0.3, max_wait=30):
+        self.path = path
+        self.qps = qps
+        self.burst = burst or qps
+        self.daily_budget = daily_budget
+        self.batch_reserve = batch_reserve
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _state(self):
+        with self._lock, open(self.path, 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+
+    def _try_take(self, key, level):
+        """Take a token if one is free. Returns 0 on success, else seconds until one may be."""
+        now = time.time()
+        today = time.strftime('%Y-%m-%d', time.gmtime(now))
+        reserve = self.batch_reserve if level == BATCH else 0
+
+        with self._state() as state:
+            bucket = state.get(key)
+            if bucket is None or bucket['day'] != today:
+                bucket = {'tokens': self.burst, 'updated': now, 'day': today, 'used': 0}
+                state[key] = bucket
+
+            bucket['tokens'] = min(self.burst, bucket['tokens'] + (now - bucket['updated']) * self.qps)
+            bucket['updated'] = now
+
+            if self.daily_budget and bucket['used'] >= self.daily_budget * (1 - reserve):
+                rejected.inc(priority=level, reason='daily_budget')
+                raise RateLimitError(f"Daily Places budget of {self.daily_budget} calls is spent")
+
+            needed = 1 + reserve * self.burst
+            if bucket['tokens'] >= needed:
+                bucket['tokens'] -= 1
+                bucket['used'] += 1
+                return 0
+            return (needed - bucket['tokens']) / self.qps
+
+    def _key(self, api_key):
+        return hashlib.sha256((api_key or '').encode()).hexdigest()[:16]
+
+    def _done(self, level, waited, taken):
+        # Only give up without a token: one taken just past max_wait is still used
+        wait_seconds.observe(waited, priority=level)
+        if not taken:
+            rejected.inc(priority=level, reason='timeout')
+            raise RateLimitError(f"Waited {waited:.1f}s for a Places rate limit token")
+
+    def acquire(self, api_key):
+        """Block until a call with api_key may be sent. Returns seconds waited."""
+        key = self._key(api_key)
+        level = priority.get()
+        started = time.perf_counter()
+        with metrics.span('ratelimit_wait', priority=level):
+            while True:
+                delay = self._try_take(key, level)
+                waited = time.perf_counter() - started
+                if not delay or waited > self.max_wait:
+                    break
+                time.sleep(min(delay, 0.25))
+        self._done(level, waited, not delay)
+        return waited
+
+    async def acquire_async(self, api_key):
+        """
+        acquire() for coroutines: the locked state file is read and written in
+        a worker thread, and waits use asyncio.sleep, so the loop never blocks.
+        """
+        key = self._key(api_key)
+        level = priority.get()
+        started = time.perf_counter()
+        with metrics.span('ratelimit_wait', priority=level):
+            while True:
+                delay = await asyncio.to_thread(self._try_take, key, level)
+                waited = time.perf_counter() - started
+                if not delay or waited > self.max_wait:
+                    break
+                await asyncio.sleep(min(delay, 0.25))
+        self._done(level, waited, not delay)
+        return waited
+
+
+_limiter = None
+_limiter_loaded = False
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide RateLimiter configured from the environment, or None if PLACES_QPS is 0."""
+    global _limiter, _limiter_loaded
+
+    if not _limiter_loaded:
+        with _limiter_lock:
+            if not _limiter_loaded:
+                qps = float(os.getenv('PLACES_QPS', '50'))
+                if qps > 0:
+                    _limiter = RateLimiter(
+                        path=os.getenv('PLACES_RATE_STATE',
+                                       os.path.join(tempfile.gettempdir(), 'places_ratelimit.json')),
+                        qps=qps,
+                        burst=float(os.getenv('PLACES_BURST', '0')) or None,
+                        daily_budget=int(os.getenv('PLACES_DAILY_BUDGET', '0')),
+                        batch_reserve=float(os.getenv('PLACES_BATCH_RESERVE', '0.3')),
+                        max_wait=float(os.getenv('PLACES_RATE_MAX_WAIT', '30')),
+                    )
+                _limiter_loaded = True
+    return _limiter
@@ -0,0 +1,213 @@
+import argparse
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+
+METERS_PER_DEGREE_LAT = 111320
+
+
+def _grid_dtype(n_categories):
+    return np.dtype([('filled', 'u1'),
+                     ('scores', 'i1', (n_categories,)),
+                     ('ratings', 'f4', (n_categories,)),
+                     ('top_place', 'i4', (n_categories,))])
+
+
+class ScoreGrid:
+    """
+    Precomputed category scores for a bounding box, read from a memory-mapped
+    file.
+
+    The grid is two files: <path>.npy holds one fixed-size record per cell
+    (scores, top ratings, and indexes into the place-name table), and
+    <path>.json holds the grid geometry, the category order and the name
+    table. Lookups snap to the nearest cell center in O(1).
+    """
+
+    def __init__(self, path):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+
+        self.path = path
+        self.min_lat = meta['min_lat']
+        self.min_lng = meta['min_lng']
+        self.lat_step = meta['lat_step']
+        self.lng_step = meta['lng_step']
+        self.rows = meta['rows']
+        self.cols = meta['cols']
+        self.categories = meta['categories']
+        self.names = meta['names']
+        self.cells = np.load(path + '.npy', mmap_mode='r')
+
+    def cell_index(self, lat, lng):
+        """(row, col) of the nearest cell, or None outside the grid."""
+        row = int(round((lat - self.min_lat) / self.lat_step))
+        col = int(round((lng - self.min_lng) / self.lng_step))
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return row, col
+        return None
+
+    def lookup(self, lat, lng):
+        """
+        Scores for the nearest cell, shaped like utils.get_all_scores, or
+        None when the point is outside the grid or its cell is not built yet.
+        """
+        index = self.cell_index(lat, lng)
+        if index is None:
+            return None
+
+        cell = self.cells[index]
+        if not cell['filled']:
+            return None
+
+        scores = {}
+        top_places = {}
+        top_ratings = {}
+        for i, category in enumerate(self.categories):
+            scores[category] = int(cell['scores'][i])
+            place_index = int(cell['top_place'][i])
+            top_places[category] = self.names[place_index] if place_index >= 0 else ''
+            top_ratings[category] = round(float(cell['ratings'][i]), 2)
+        return scores, top_places, top_ratings
+
+
+_grid = None
+_grid_lock = threading.Lock()
+
+
+def get_score_grid():
+    """Return the grid named by SCORE_GRID_PATH, loaded on first use, or None."""
+    global _grid
+
+    path = os.getenv('SCORE_GRID_PATH')
+    if not path or not os.path.exists(path + '.npy'):
+        return None
+
+    if _grid is None:
+        with _grid_lock:
+            if _grid is None:
+                _grid = ScoreGrid(path)
+    return _grid
+
+
+def build_grid(path, min_lat, min_lng, max_lat, max_lng, resolution_m=500, workers=4):
+    """
+    Score every cell center in the bounding box with utils.get_all_scores and
+    write the results to <path>.npy / <path>.json.
+
+    Rebuilding into an existing grid with the same geometry skips cells that
+    are already filled, so an interrupted build can be resumed. The name
+    table is saved whenever the build stops; a cell pointing past it (the
+    process was killed before it could be saved) is scored again.
+    """
+    import ratelimit
+    import utils
+
+    categories = [c for c, spec in utils.category_specs.items() if spec['enabled']]
+    lat_step = resolution_m / METERS_PER_DEGREE_LAT
+    lng_step = resolution_m / (METERS_PER_DEGREE_LAT * math.cos(math.radians((min_lat + max_lat) / 2)))
+    rows = int(math.floor((max_lat - min_lat) / lat_step)) + 1
+    cols = int(math.floor((max_lng - min_lng) / lng_step)) + 1
+
+    meta = {'min_lat': min_lat, 'min_lng': min_lng, 'lat_step': lat_step, 'lng_step': lng_step,
+            'rows': rows, 'cols': cols, 'resolution_m': resolution_m,
+            'categories': categories, 'names': []}
+
+    if os.path.exists(path + '.json') and os.path.exists(path + '.npy'):
+        with open(path + '.json') as f:
+            old_meta = json.load(f)
+        if all(old_meta.get(k) == meta[k] for k in ('min_lat', 'min_lng', 'rows', 'cols', 'resolution_m', 'categories')):
+            meta['names'] = old_meta['names']
+            cells = np.load(path + '.npy', mmap_mode='r+')
+            orphaned = cells['filled'].astype(bool) & (cells['top_place'] >= len(meta['names'])).any(axis=-1)
+            if orphaned.any():
+                print(f"{int(orphaned.sum())} cells name places missing from {path}.json; scoring them again")
+                cells['filled'][orphaned] = 0
+        else:
+            cells = None
+    else:
+        cells = None
+
+    if cells is None:
+        cells = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=_grid_dtype(len(categories)),
+                                          shape=(rows, cols))
+        cells['top_place'] = -1
+
+    name_index = {name: i for i, name in enumerate(meta['names'])}
+    lock = threading.Lock()
+
+    def save_meta():
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.json.tmp', path + '.json')
+
+    def score_cell(row, col):
+        lat = min_lat + row * lat_step
+        lng = min_lng + col * lng_step
+        with ratelimit.priority_scope(ratelimit.BATCH):
+            return row, col, utils.get_all_scores(lat, lng)
+
+    todo = [(r, c) for r in range(rows) for c in range(cols) if not cells[r, c]['filled']]
+    print(f"Grid {rows}x{cols} ({rows * cols} cells), {len(todo)} to score")
+
+    done = 0
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(score_cell, r, c) for r, c in todo]
+        for future in as_completed(futures):
+            try:
+                row, col, (scores, top_places, top_ratings) = future.result()
+            except Exception as e:
+                print(f"Cell failed, will be retried on the next build: {e}")
+                continue
+
+            with lock:
+                cell = cells[row, col]
+                for i, category in enumerate(categories):
+                    cell['scores'][i] = scores[category]
+                    cell['ratings'][i] = top_ratings[category]
+                    name = top_places[category]
+                    if name:
+                        if name not in name_index:
+                            name_index[name] = len(meta['names'])
+                            meta['names'].append(name)
+                        cell['top_place'][i] = name_index[name]
+                    else:
+                        cell['top_place'][i] = -1
+                cell['filled'] = 1
+
+                done += 1
+                if done % 100 == 0:
+                    cells.flush()
+                    save_meta()
+                    print(f"{done}/{len(todo)} cells scored")
+        pool.shutdown()
+    except BaseException:
+        # Ctrl-C or an error: drop the queued cells instead of scoring them
+        # all first; the ones running finish and are discarded
+        pool.shutdown(wait=False, cancel_futures=True)
+        print(f"Build stopped after {done}/{len(todo)} cells; run it again to resume")
+        raise
+    finally:
+        cells.flush()
+        save_meta()
+
+    print(f"Wrote {path}.npy and {path}.json")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute location scores over a bounding box.")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("MIN_LAT", "MIN_LNG", "MAX_LAT", "MAX_LNG"),
+                        default=[12.83, 77.46, 13.14, 77.78], help="Area to cover (default: Bengaluru)")
+    parser.add_argument("--resolution", type=float, default=500, help="Cell size in meters")
+    parser.add_argument("--workers", type=int, default=4, help="Cells scored at the same time")
+    parser.add_argument("--out", default=os.getenv('SCORE_GRID_PATH', 'score_grid'),
+                        help="Output path without extension")
+    args = parser.parse_args()
+
+    build_grid(args.out, *args.bbox, resolution_m=args.resolution, workers=args.workers)
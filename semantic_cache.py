@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from cache import geohash_encode
+
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'gemini-embedding-001')
+
+
+def _unit_vector(result):
+    vector = np.asarray(result.embeddings[0].values, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+async def embed_text_async(client, text):
+    """Unit-length embedding of text from the GenAI embeddings API, through the async client (client.aio)."""
+    return _unit_vector(await client.aio.models.embed_content(model=EMBEDDING_MODEL, contents=text))
+
+
+class SemanticCache:
+    """
+    Final chat answers keyed by message embedding and the geohash cell of
+    the user's location.
+
+    A lookup compares the message embedding with every live entry in the
+    same cell (brute-force cosine similarity, one matrix product) and returns
+    the best answer at or above the similarity threshold.
+
+    Parameters:
+        threshold (float): Minimum cosine similarity for a hit.
+        ttl (float): Seconds an answer stays valid.
+        precision (int): Geohash precision of the location cell.
+        max_entries_per_cell (int): Oldest entries in a cell are dropped past this.
+    """
+
+    def __init__(self, threshold=0.92, ttl=3600, precision=6, max_entries_per_cell=256):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.precision = precision
+        self.max_entries_per_cell = max_entries_per_cell
+        self._cells = {}  # cell -> list of (expires_at, embedding, message, answer)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _live_entries(self, cell):
+        now = time.time()
+        entries = [e for e in self._cells.get(cell, []) if e[0] > now]
+        if entries:
+            self._cells[cell] = entries
+        else:
+            self._cells.pop(cell, None)
+        return entries
+
+    def lookup(self, embedding, lat, lng):
+        """Return (answer, similarity) for the closest cached question nearby, or (None, best similarity)."""
+        cell = geohash_encode(lat, lng, self.precision)
+        with self._lock:
+            entries = self._live_entries(cell)
+            if not entries:
+                self.misses += 1
+                return None, 0.0
+
+            similarities = np.vstack([e[1] for e in entries]) @ embedding
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity >= self.threshold:
+                self.hits += 1
+                return entries[best][3], similarity
+
+            self.misses += 1
+            return None, similarity
+
+    def add(self, embedding, lat, lng, message, answer):
+        cell = geohash_encode(lat, lng, self.precision)
+        with self._lock:
+            entries = self._live_entries(cell)
+            entries.append((time.time() + self.ttl, embedding, message, answer))
+            self._cells[cell] = entries[-self.max_entries_per_cell:]
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': sum(len(entries) for entries in self._cells.values()),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+answer_cache = SemanticCache(threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92')),
+                             ttl=float(os.getenv('SEMANTIC_CACHE_TTL', '3600')),
+                             precision=int(os.getenv('SEMANTIC_CACHE_PRECISION', '6')))
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultStore:
+    """
+    Persistent key/value store with per-entry TTL, backed by SQLite in WAL mode.
+
+    Every gunicorn worker opens the same file, so results fetched by one worker
+    are visible to the others and survive restarts and redeploys. Values are
+    stored as JSON.
+
+    Parameters:
+        path (str): SQLite database file.
+        table (str): Table name, so several stores can share one file.
+        ttl (float): Default seconds an entry stays valid.
+    """
+
+    def __init__(self, path, table='results', ttl=24 * 3600):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                     "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires_at ON {self.table} (expires_at)")
+        conn.commit()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the stored value, or None if it is missing or expired."""
+        try:
+            row = self._connect().execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+                (key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            print(f"ResultStore get failed: {e}")
+            return None
+
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            conn = self._connect()
+            conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), expires_at))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"ResultStore set failed: {e}")
+
+    def set_many(self, items, ttl=None):
+        """Write every (key, value) of the dict items in one transaction."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            conn = self._connect()
+            conn.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                             [(key, json.dumps(value), expires_at) for key, value in items.items()])
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"ResultStore set_many failed: {e}")
+
+    def get_prefix(self, prefix):
+        """Return {key: value} for every live entry whose key starts with prefix."""
+        try:
+            rows = self._connect().execute(
+                f"SELECT key, value FROM {self.table} WHERE key >= ? AND key < ? AND expires_at > ?",
+                (prefix, prefix + '\uffff', time.time())).fetchall()
+        except sqlite3.Error as e:
+            print(f"ResultStore get_prefix failed: {e}")
+            return {}
+        return {key: json.loads(value) for key, value in rows}
+
+    def purge_expired(self):
+        """Delete expired entries. Returns the number of rows removed."""
+        conn = self._connect()
+        cursor = conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+        return cursor.rowcount
+
+    def compact(self):
+        """Purge expired entries, then reclaim file space and truncate the WAL."""
+        removed = self.purge_expired()
+        conn = self._connect()
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    def count(self):
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the persistent result store.")
+    parser.add_argument("command", choices=["compact", "stats"])
+    parser.add_argument("--path", default=os.getenv('PLACES_STORE_PATH', 'places_cache.sqlite3'))
+    parser.add_argument("--table", default='places')
+    args = parser.parse_args()
+
+    result_store = ResultStore(args.path, table=args.table)
+    if args.command == "compact":
+        removed = result_store.compact()
+        print(f"Removed {removed} expired entries; {result_store.count()} remain in {args.path}")
+    else:
+        print(f"{result_store.count()} entries in {args.path} ({os.path.getsize(args.path)} bytes)")
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Nothing on disk, no rate limiter, no place index: tests read only what they serve
+os.environ.update({'PLACES_STORE_PATH': '', 'LLM_STORE_PATH': '', 'SCORE_GRID_PATH': '',
+                   'PLACES_QPS': '0', 'PLACE_INDEX_MIN_PLACES': '0', 'TRAFFIC_MODE': 'passthrough',
+                   'google_place_api_key': 'test'})
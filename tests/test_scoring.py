@@ -0,0 +1,189 @@
+"""
+Regression test for the category scorers.
+
+scoring_baseline.json holds, for fixed points, what the original
+per-category get_* loops returned when every query's first two pages
+(up to 40 places, ranked by distance) were fetched up front. The
+scoring engine must give the same [score, top_place, top_rating] while
+paging lazily. The only intended difference is kept here as well: where
+the old loops fell through and returned None (Rental Availability with 10
+hotels averaging over 20 km, seeds 8, 20 and 47), the spec scores it.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import time
+
+import pytest
+
+import aio
+import places_client
+import utils
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'scoring_baseline.json')
+PAGE_SIZE = 20
+
+
+def fixture_results(seed, lat, lng, query):
+    """
+    Text Search results for query around (lat, lng), nearest first. Counts
+    and spacings are chosen so that some queries run far past every ladder
+    distance, which is where lazy paging cutoffs would show.
+    """
+    rng = random.Random(f"{seed}|{query}")
+    count = rng.choice([0, 1, 3, 8, 15, 25, 40])
+    spacing = rng.choice([0.1, 0.5, 1.5, 3.0, 6.0])  # km between consecutive places
+
+    results = []
+    for i in range(count):
+        distance = 0.0 if i == 0 and rng.random() < 0.1 else spacing * (i + rng.random())
+        bearing = rng.uniform(0, 2 * math.pi)
+        results.append({
+            'name': f"{query} {i + 1}",
+            'formatted_address': f"{i + 1} Main Road",
+            'geometry': {'location': {'lat': lat + distance / 111.32 * math.cos(bearing),
+                                      'lng': lng + distance / (111.32 * math.cos(math.radians(lat)))
+                                      * math.sin(bearing)}},
+            'rating': rng.choice([None, 1, 2.5, 3.9, 4.2, 4.5, 5, round(rng.uniform(1, 5), 1)]),
+            'user_ratings_total': rng.randint(1, 500),
+            'place_id': f"{seed}-{query}-{i}",
+        })
+    return results
+
+
+class FakePlacesClient:
+    """Serves fixture_results for one point, PAGE_SIZE per page, and counts calls."""
+
+    def __init__(self, seed, lat, lng):
+        self.seed, self.lat, self.lng = seed, lat, lng
+        self.calls = 0
+
+    def _page(self, query, page):
+        self.calls += 1
+        results = fixture_results(self.seed, self.lat, self.lng, query)
+        response = {'status': 'OK' if results else 'ZERO_RESULTS',
+                    'results': results[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]}
+        if (page + 1) * PAGE_SIZE < len(results):
+            response['next_page_token'] = f"{query}:{page + 1}"
+        return response
+
+    def text_search(self, params, timeout=None):
+        return self._page(params['query'], 0)
+
+    def text_search_page(self, params, page_token, **kwargs):
+        return self._page(params['query'], int(page_token.rsplit(':', 1)[1]))
+
+    def close(self):
+        pass
+
+
+class FakeAsyncPlacesClient(FakePlacesClient):
+    async def text_search(self, params, timeout=None):
+        return FakePlacesClient.text_search(self, params, timeout)
+
+    async def text_search_page(self, params, page_token, **kwargs):
+        return FakePlacesClient.text_search_page(self, params, page_token, **kwargs)
+
+    async def close(self):
+        pass
+
+
+with open(BASELINE) as f:
+    CASES = json.load(f)
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def install(case):
+        utils.places_cache.clear()
+        monkeypatch.setattr(places_client, '_client', FakePlacesClient(case['seed'], case['lat'], case['lng']))
+        monkeypatch.setattr(places_client, '_async_client',
+                            FakeAsyncPlacesClient(case['seed'], case['lat'], case['lng']))
+    return install
+
+
+def _as_lists(scores):
+    return {category: list(result) for category, result in scores.items()}
+
+
+@pytest.mark.parametrize('case', CASES, ids=[str(case['seed']) for case in CASES])
+def test_score_categories_match_old_loops(case, serve):
+    serve(case)
+    scores = utils.score_categories(case['lat'], case['lng'], categories=list(case['expected']))
+    assert _as_lists(scores) == case['expected']
+
+
+@pytest.mark.parametrize('case', CASES, ids=[str(case['seed']) for case in CASES])
+def test_score_categories_async_match_old_loops(case, serve):
+    serve(case)
+    scores = aio.run(utils.score_categories_async(case['lat'], case['lng'], categories=list(case['expected'])))
+    assert _as_lists(scores) == case['expected']
+
+
+@pytest.mark.parametrize('case', CASES[:5], ids=[str(case['seed']) for case in CASES[:5]])
+def test_iter_scores_match_old_loops(case, serve):
+    serve(case)
+    scores = dict(utils.iter_scores(case['lat'], case['lng'], categories=list(case['expected'])))
+    assert _as_lists(scores) == case['expected']
+
+
+PAGE_DELAY = 0.3
+
+
+class SlowPageClient(FakePlacesClient):
+    """
+    Every query gets a short first page (5 places within 2.5 km) and a
+    second page that takes PAGE_DELAY to arrive, so each capped category
+    has to fetch page 2 before it can be scored.
+    """
+
+    def _page(self, query, page):
+        self.calls += 1
+        results = [{'name': f"{query} {page * 5 + i + 1}",
+                    'geometry': {'location': {'lat': self.lat + (page * 5 + i + 1) * 0.5 / 111.32,
+                                              'lng': self.lng}},
+                    'rating': 4.0, 'place_id': f"{query}-{page}-{i}"} for i in range(5)]
+        response = {'status': 'OK', 'results': results}
+        if page == 0:
+            response['next_page_token'] = f"{query}:1"
+        return response
+
+    def text_search_page(self, params, page_token, **kwargs):
+        time.sleep(PAGE_DELAY)
+        return FakePlacesClient.text_search_page(self, params, page_token)
+
+
+class SlowPageAsyncClient(SlowPageClient):
+    async def text_search(self, params, timeout=None):
+        return SlowPageClient.text_search(self, params, timeout)
+
+    async def text_search_page(self, params, page_token, **kwargs):
+        await asyncio.sleep(PAGE_DELAY)
+        return FakePlacesClient.text_search_page(self, params, page_token)
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.parametrize('path', ['sync', 'async', 'stream'])
+def test_second_pages_are_fetched_concurrently(path, monkeypatch):
+    utils.places_cache.clear()
+    monkeypatch.setattr(places_client, '_client', SlowPageClient(0, 12.97, 77.59))
+    monkeypatch.setattr(places_client, '_async_client', SlowPageAsyncClient(0, 12.97, 77.59))
+    categories = ['Rental Availability', 'Safety', 'Connectivity', 'Entertainment', 'Education']
+
+    started = time.perf_counter()
+    if path == 'sync':
+        scores = utils.score_categories(12.97, 77.59, categories)
+    elif path == 'async':
+        scores = aio.run(utils.score_categories_async(12.97, 77.59, categories))
+    else:
+        scores = dict(utils.iter_scores(12.97, 77.59, categories))
+    elapsed = time.perf_counter() - started
+
+    assert sorted(scores) == sorted(categories)
+    # One page-2 wait per category; run one after another they would take 5 x PAGE_DELAY
+    assert elapsed < 2.5 * PAGE_DELAY
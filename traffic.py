@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+MODES = ('passthrough', 'record', 'replay')
+
+
+class TrafficMiss(KeyError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def _default(value):
+    # Response schemas are classes (e.g. utils.MapsPlan); record them by name
+    return getattr(value, '__name__', repr(value))
+
+
+class Traffic:
+    """
+    Record/replay transport for outgoing Places and Gemini calls.
+
+    passthrough: calls go out as usual.
+    record: calls go out, and each request/response pair is appended to
+        path as one JSON line, with how long it took.
+    replay: calls are answered from path without touching the network.
+        Identical requests get their recorded responses in order, cycling
+        when they run out. Each reply waits its recorded time times
+        time_scale (1 for the original timing, 0 for none).
+
+    API keys are dropped from recorded requests.
+
+    Parameters:
+        mode (str): 'passthrough', 'record' or 'replay'.
+        path (str): JSONL file to write or read.
+        time_scale (float): Multiplier on recorded durations in replay mode.
+    """
+
+    def __init__(self, mode='passthrough', path='traffic.jsonl', time_scale=1.0):
+        if mode not in MODES:
+            raise ValueError(f"Traffic mode must be one of {MODES}, not {mode!r}")
+        self.mode = mode
+        self.path = path
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._recorded = {}  # (kind, key) -> [entry, ...]
+        self._cursor = {}
+
+        if mode == 'replay':
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._recorded.setdefault((entry['kind'], entry['key']), []).append(entry)
+            print(f"Replaying {sum(len(v) for v in self._recorded.values())} recorded calls from {path}")
+
+    @staticmethod
+    def request_key(request):
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=_default).encode()).hexdigest()
+
+    def _next(self, kind, request):
+        key = (kind, self.request_key(request))
+        with self._lock:
+            entries = self._recorded.get(key)
+            if not entries:
+                raise TrafficMiss(f"No recorded {kind} call for {json.dumps(request, default=_default)[:200]}")
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+        return entries[i % len(entries)]
+
+    def _write(self, kind, request, response, elapsed):
+        line = json.dumps({'kind': kind, 'key': self.request_key(request), 'request': request,
+                           'response': response, 'elapsed': round(elapsed, 4),
+                           'recorded_at': time.time()}, default=_default)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+    def call(self, kind, request, send):
+        """Return send()'s JSON-able result, recorded or replayed according to the mode."""
+        if self.mode == 'replay':
+            entry = self._next(kind, request)
+            time.sleep(entry['elapsed'] * self.time_scale)
+            return entry['response']
+
+        started = time.perf_counter()
+        response = send()
+        if self.mode == 'record':
+            self._write(kind, request, response, time.perf_counter() - started)
+        return response
+
+    async def acall(self, kind, request, send):
+        """call() for coroutines: send() returns an awaitable."""
+        if self.mode == 'replay':
+            entry = self._next(kind, request)
+            await asyncio.sleep(entry['elapsed'] * self.time_scale)
+            return entry['response']
+
+        started = time.perf_counter()
+        response = await send()
+        if self.mode == 'record':
+            self._write(kind, request, response, time.perf_counter() - started)
+        return response
+
+    def stream(self, kind, request, send):
+        """Yield the text chunks of send()'s stream; recorded with each chunk's offset in seconds."""
+        if self.mode == 'replay':
+            entry = self._next(kind, request)
+            offset = 0.0
+            for at, text in entry['response']:
+                time.sleep((at - offset) * self.time_scale)
+                offset = at
+                yield text
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        for text in send():
+            chunks.append((round(time.perf_counter() - started, 4), text))
+            yield text
+        if self.mode == 'record':
+            self._write(kind, request, chunks, time.perf_counter() - started)
+
+    async def astream(self, kind, request, send):
+        """stream() for async iterators: send() returns an awaitable of one."""
+        if self.mode == 'replay':
+            entry = self._next(kind, request)
+            offset = 0.0
+            for at, text in entry['response']:
+                await asyncio.sleep((at - offset) * self.time_scale)
+                offset = at
+                yield text
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        async for chunk in await send():
+            chunks.append((round(time.perf_counter() - started, 4), chunk.text))
+            yield chunk.text
+        if self.mode == 'record':
+            self._write(kind, request, chunks, time.perf_counter() - started)
+
+
+def _places_request(params, page_token=None):
+    request = {k: v for k, v in params.items() if k != 'key'}
+    if page_token:
+        request['pagetoken'] = page_token
+    return request
+
+
+class TrafficPlacesClient:
+    """PlacesClient whose text searches go through a Traffic transport."""
+
+    def __init__(self, client, traffic):
+        self.client = client
+        self.traffic = traffic
+
+    def text_search(self, params, timeout=None):
+        return self.traffic.call('places', _places_request(params),
+                                 lambda: self.client.text_search(params, timeout))
+
+    def text_search_page(self, params, page_token, **kwargs):
+        return self.traffic.call('places', _places_request(params, page_token),
+                                 lambda: self.client.text_search_page(params, page_token, **kwargs))
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+
+class TrafficAsyncPlacesClient(TrafficPlacesClient):
+    """AsyncPlacesClient whose text searches go through a Traffic transport."""
+
+    async def text_search(self, params, timeout=None):
+        return await self.traffic.acall('places', _places_request(params),
+                                        lambda: self.client.text_search(params, timeout))
+
+    async def text_search_page(self, params, page_token, **kwargs):
+        return await self.traffic.acall('places', _places_request(params, page_token),
+                                        lambda: self.client.text_search_page(params, page_token, **kwargs))
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+
+
+class _Text:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Embedding:
+    def __init__(self, values):
+        self.values = values
+
+
+class _Embeddings:
+    def __init__(self, values):
+        self.embeddings = [_Embedding(values)]
+
+
+def _llm_request(model, contents, config=None):
+    return {'model': model, 'contents': contents, 'config': config}
+
+
+class _TrafficModels:
+    def __init__(self, models, traffic):
+        self.models = models
+        self.traffic = traffic
+
+    def generate_content(self, model, contents, config=None):
+        def send():
+            return self.models.generate_content(model=model, contents=contents, config=config).text
+        return _Text(self.traffic.call('generate_content', _llm_request(model, contents, config), send))
+
+    def generate_content_stream(self, model, contents, config=None):
+        def send():
+            for chunk in self.models.generate_content_stream(model=model, contents=contents, config=config):
+                yield chunk.text
+        for text in self.traffic.stream('generate_content_stream', _llm_request(model, contents, config), send):
+            yield _Text(text)
+
+    def embed_content(self, model, contents, config=None):
+        def send():
+            return list(self.models.embed_content(model=model, contents=contents, config=config).embeddings[0].values)
+        return _Embeddings(self.traffic.call('embed_content', _llm_request(model, contents, config), send))
+
+
+class _TrafficAsyncModels(_TrafficModels):
+    async def generate_content(self, model, contents, config=None):
+        async def send():
+            return (await self.models.generate_content(model=model, contents=contents, config=config)).text
+        return _Text(await self.traffic.acall('generate_content', _llm_request(model, contents, config), send))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        async def chunks():
+            send = lambda: self.models.generate_content_stream(model=model, contents=contents, config=config)
+            async for text in self.traffic.astream('generate_content_stream',
+                                                   _llm_request(model, contents, config), send):
+                yield _Text(text)
+        return chunks()
+
+    async def embed_content(self, model, contents, config=None):
+        async def send():
+            response = await self.models.embed_content(model=model, contents=contents, config=config)
+            return list(response.embeddings[0].values)
+        return _Embeddings(await self.traffic.acall('embed_content', _llm_request(model, contents, config), send))
+
+
+class TrafficGenaiClient:
+    """
+    GenAI client whose models.generate_content(_stream) and embed_content
+    calls, and their client.aio versions, go through a Traffic transport.
+    In replay mode client can be None.
+    """
+
+    def __init__(self, client, traffic):
+        self.client = client
+        self.models = _TrafficModels(client.models if client else None, traffic)
+        self.aio = type('AsyncClient', (), {})()
+        self.aio.models = _TrafficAsyncModels(client.aio.models if client else None, traffic)
+
+
+_traffic = None
+_traffic_lock = threading.Lock()
+
+
+def get_traffic():
+    """Return the process-wide Traffic from TRAFFIC_MODE, TRAFFIC_PATH and TRAFFIC_TIME_SCALE."""
+    global _traffic
+
+    if _traffic is None:
+        with _traffic_lock:
+            if _traffic is None:
+                _traffic = Traffic(mode=os.getenv('TRAFFIC_MODE', 'passthrough'),
+                                   path=os.getenv('TRAFFIC_PATH', 'traffic.jsonl'),
+                                   time_scale=float(os.getenv('TRAFFIC_TIME_SCALE', '1')))
+    return _traffic
+
+
+def wrap_places(client, async_client=False):
+    """client, routed through the traffic transport unless in passthrough mode."""
+    traffic = get_traffic()
+    if traffic.mode == 'passthrough':
+        return client
+    return (TrafficAsyncPlacesClient if async_client else TrafficPlacesClient)(client, traffic)
+
+
+def wrap_genai(client):
+    """client, routed through the traffic transport unless in passthrough mode."""
+    traffic = get_traffic()
+    if traffic.mode == 'passthrough':
+        return client
+    return TrafficGenaiClient(client, traffic)
+
+
+def replaying():
+    return get_traffic().mode == 'replay'
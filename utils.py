@@ -1,14 +1,37 @@
-import requests
-import time
+import asyncio
+import contextvars
+import hashlib
+import itertools
 import math
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from typing import Optional
 
 from dotenv import load_dotenv
+import numpy as np
 import os
+from pydantic import BaseModel, ValidationError
+
+from places_client import get_places_client, get_async_places_client
+from cache import LRUCache, geohash_encode, haversine_np
+from store import ResultStore
+from place_index import PlaceIndex
+import metrics
+import ratelimit
 
 
 load_dotenv()
 
 
+# Upper bound on Places query chains running at the same time, across all
+# requests served by this process.
+PLACES_MAX_CONCURRENCY = int(os.getenv('PLACES_MAX_CONCURRENCY', '12'))
+# The same for batch work (batch scoring, grid builds), on a pool of its own.
+PLACES_BATCH_CONCURRENCY = int(os.getenv('PLACES_BATCH_CONCURRENCY', '4'))
+
+
 query_dict = {'Rental Availability': "Hotels near me", \
               'Safety': "police stations near me", \
               'Connectivity': ["bus stop near me", "metro station near me", "train station near me", 'airport near me'],\
@@ -25,59 +48,524 @@ query_dict = {'Rental Availability': "Hotels near me", \
                                            "offices near me", "factories near me"]
               }
 
-def search_places(query, lat, lng, radius, api_key, max_pages=2):
+# How each category is scored. A category averages the distance to the
+# places found by its queries, in order. 'sample_cap' stops reading a query
+# once that many places are counted, after which every later query adds only
+# its first place; None reads every place. 'ladder' rows are
+# (min places or None, max average distance km, score), tried in order;
+# 'default' is the score when none match. A math.inf row catches every
+# distance past the others, so enough places that are far away do not fall
+# through to a higher default. Only 'enabled' categories are part of
+# get_all_scores. For capped categories, no page is fetched past the widest
+# finite ladder distance.
+category_specs = {
+    'Rental Availability': {'queries': [query_dict['Rental Availability']], 'sample_cap': 10, 'enabled': True,
+                            'ladder': [(10, 1.5, 5), (10, 3, 4), (10, 5, 3), (10, 10, 2), (10, 20, 1),
+                                       (10, math.inf, 0)],
+                            'default': 2},
+    'Safety': {'queries': [query_dict['Safety']], 'sample_cap': 4, 'enabled': True,
+               'ladder': [(3, 5, 5), (1, 5, 4), (None, 10, 3), (None, 20, 2), (None, 50, 1)],
+               'default': 0},
+    'Connectivity': {'queries': query_dict['Connectivity'], 'sample_cap': 10, 'enabled': True,
+                     'ladder': [(10, 2, 5), (10, 5, 4), (5, 10, 3), (2, 10, 2), (1, 10, 1)],
+                     'default': 0},
+    # 'Health': assumed good, not scored
+    'Entertainment': {'queries': query_dict['Entertainment'], 'sample_cap': 10, 'enabled': True,
+                      'ladder': [(10, 2, 5), (10, 5, 4), (5, 10, 3), (2, 10, 2), (1, 10, 1)],
+                      'default': 0},
+    'Education': {'queries': query_dict['Education'], 'sample_cap': 10, 'enabled': True,
+                  'ladder': [(10, 10, 5), (7, 20, 4), (5, 20, 3), (2, 20, 2), (1, 20, 1)],
+                  'default': 0},
+    'Environment': {'queries': query_dict['Environment'], 'sample_cap': 10, 'enabled': False,
+                    'ladder': [(10, 10, 5), (7, 20, 4), (5, 20, 3), (2, 20, 2), (1, 20, 1)],
+                    'default': 0},
+    'Community and Culture': {'queries': query_dict['Community and Culture'], 'sample_cap': None, 'enabled': False,
+                              'ladder': [(10, 3, 5), (7, 5, 4), (5, 10, 3), (2, 20, 2), (1, 20, 1)],
+                              'default': 0},
+    'Digital & Civic Infrastructure': {'queries': query_dict['Digital & Civic Infrastructure'], 'sample_cap': None,
+                                       'enabled': False,
+                                       'ladder': [(3, 10, 5), (3, 20, 4), (3, 30, 3), (2, 30, 2), (1, 30, 1)],
+                                       'default': 0},
+    'Employment Opportunities': {'queries': query_dict['Employment Opportunities'], 'sample_cap': None,
+                                 'enabled': False,
+                                 'ladder': [(10, 30, 5), (5, 30, 4), (5, 50, 3), (2, 50, 2), (1, 50, 1)],
+                                 'default': 0},
+}
+
+# Geohash precision used to bucket cached search results per category. Coarser
+# cells share more results between nearby clicks; categories scored on short
+# distances (hotels within 1.5km, cafes) keep finer cells.
+cache_precision = {'Rental Availability': 7,
+                   'Safety': 6,
+                   'Connectivity': 6,
+                   'Health': 6,
+                   'Entertainment': 7,
+                   'Education': 6,
+                   'Environment': 6,
+                   'Community and Culture': 6,
+                   'Digital & Civic Infrastructure': 5,
+                   'Employment Opportunities': 5,
+                   }
+DEFAULT_CACHE_PRECISION = 7
+
+places_cache = LRUCache(max_bytes=int(float(os.getenv('PLACES_CACHE_MAX_MB', '64')) * 1024 * 1024),
+                        ttl=float(os.getenv('PLACES_CACHE_TTL', str(6 * 3600))))
+
+# Shared on-disk layer behind places_cache; every worker process reads and
+# writes the same SQLite file. Set PLACES_STORE_PATH to an empty string to
+# disable it.
+_places_store_path = os.getenv('PLACES_STORE_PATH', 'places_cache.sqlite3')
+places_store = None
+if _places_store_path:
+    places_store = ResultStore(_places_store_path, table='places',
+                               ttl=float(os.getenv('PLACES_STORE_TTL', str(24 * 3600))))
+
+# Every place fetched, by location, persisted next to places_store. Searches
+# are answered from it when fresh searches near the point already found at
+# least PLACE_INDEX_MIN_PLACES places for the query (0 turns the index off).
+PLACE_INDEX_MIN_PLACES = int(os.getenv('PLACE_INDEX_MIN_PLACES', '10'))
+_place_index_max_age = float(os.getenv('PLACE_INDEX_MAX_AGE', str(24 * 3600)))
+place_index = None
+if PLACE_INDEX_MIN_PLACES > 0:
+    place_index = PlaceIndex(precision=int(os.getenv('PLACE_INDEX_PRECISION', '5')),
+                             max_age=_place_index_max_age,
+                             store=ResultStore(_places_store_path, table='place_index', ttl=_place_index_max_age)
+                             if _places_store_path else None)
+# How far from the point an earlier search may have been centred to count
+PLACE_INDEX_SEARCH_KM = float(os.getenv('PLACE_INDEX_SEARCH_KM', '1'))
+# Radius searched in the index when the caller sets no max_distance
+PLACE_INDEX_RADIUS_KM = float(os.getenv('PLACE_INDEX_RADIUS_KM', '5'))
+
+
+def normalize_query(query):
+    """
+    Lower-case, strip punctuation and the trailing "near me" so that
+    "Cafes near me" and "cafes" share cache entries.
+    """
+    query = re.sub(r"[^\w\s/&]", " ", query.lower())
+    query = " ".join(query.split())
+    if query.endswith(" near me"):
+        query = query[:-len(" near me")]
+    return query
+
+
+def _build_query_precision():
+    precision = {}
+    for category, queries in query_dict.items():
+        if type(queries) == str:
+            queries = [queries]
+        for query_str in queries:
+            precision[normalize_query(query_str)] = cache_precision.get(category, DEFAULT_CACHE_PRECISION)
+    return precision
+
+_query_precision = _build_query_precision()
+
+
+def places_cache_key(query, lat, lng):
+    """Cache key for a search: normalized query plus the geohash cell of the origin."""
+    query = normalize_query(query)
+    precision = _query_precision.get(query, DEFAULT_CACHE_PRECISION)
+    return query + '@' + geohash_encode(lat, lng, precision)
+
+
+# Places formalize_context turns into chat context; the chat search asks
+# for exactly this many.
+CHAT_CONTEXT_PLACES = 4
+
+
+class Place:
+    """
+    One Places result, keeping only the fields the app reads.
+
+    Slotted, so a place costs a fraction of a dict, and a page of raw API
+    JSON (photos, opening hours, ...) doesn't stay alive behind it. Stored
+    in caches as a plain list (to_record / from_record).
+    """
+
+    __slots__ = ('name', 'address', 'lat', 'lng', 'rating', 'user_ratings_total', 'place_id')
+
+    def __init__(self, name=None, address=None, lat=None, lng=None, rating=None, user_ratings_total=None,
+                 place_id=None):
+        self.name = name
+        self.address = address
+        self.lat = lat
+        self.lng = lng
+        self.rating = rating
+        self.user_ratings_total = user_ratings_total
+        self.place_id = place_id
+
+    @classmethod
+    def from_result(cls, result):
+        """Build from one entry of a Text Search response's "results"."""
+        location = result.get("geometry", {}).get("location", {})
+        return cls(result.get("name"), result.get("formatted_address"), location.get("lat"), location.get("lng"),
+                   result.get("rating"), result.get("user_ratings_total"), result.get("place_id"))
+
+    def to_record(self):
+        return [self.name, self.address, self.lat, self.lng, self.rating, self.user_ratings_total, self.place_id]
+
+    @classmethod
+    def from_record(cls, record):
+        # Entries stored before places were compacted hold dicts
+        if isinstance(record, dict):
+            return cls(**{k: record.get(k) for k in cls.__slots__})
+        return cls(*record)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return f"Place({self.name!r}, {self.lat}, {self.lng}, rating={self.rating})"
+
+
+def _response_summary(response_json):
+    """What LazyPlaces keeps of a raw response unless keep_raw is set."""
+    return {k: response_json[k] for k in ("status", "error_message", "next_page_token") if k in response_json}
+
+
+# Query chains of every request share this pool, which caps how many run at once.
+_places_pool = ThreadPoolExecutor(max_workers=PLACES_MAX_CONCURRENCY, thread_name_prefix='places')
+# Batch-priority chains queue here instead, so a large batch never sits in
+# front of chat and clicks.
+_batch_places_pool = ThreadPoolExecutor(max_workers=PLACES_BATCH_CONCURRENCY, thread_name_prefix='places-batch')
+
+
+def _submit(pool, fn, *args):
+    """pool.submit(fn, *args), run in a copy of the caller's context so its timing spans count toward the request."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _submit_places(fn, *args):
+    """_submit on the places pool for the caller's priority (see ratelimit.priority)."""
+    pool = _batch_places_pool if ratelimit.priority.get() == ratelimit.BATCH else _places_pool
+    return _submit(pool, fn, *args)
+
+
+def _submit_batch(pool, fn, *args):
+    """_submit at batch priority: fn's Places calls yield to chat and clicks in the rate limiter."""
+    with ratelimit.priority_scope(ratelimit.BATCH):
+        return _submit(pool, fn, *args)
+
+
+class LazyPlaces:
+    """
+    Places Text Search results that are fetched page by page, only when
+    iteration reaches the end of what has been fetched so far.
+
+    The first pages come from places_cache / places_store when a search for
+    the same query in the same geohash cell is cached. Otherwise, when
+    place_index already covers the area, the results are its nearest places
+    within max_distance (or PLACE_INDEX_RADIUS_KM), as one complete page.
+    Because results are ranked by distance, no further page is requested
+    once a page ends beyond max_distance km from the origin.
+
+    Parameters:
+        query (str): Search query (e.g., "hospital").
+        lat (float): Latitude.
+        lng (float): Longitude.
+        api_key (str): Your Google Maps API key.
+        max_pages (int): Max number of paginated result pages to fetch.
+        max_distance (float): Stop paging past this distance in km (None for no cutoff).
+        keep_raw (bool): Keep the last page's full API response in response_json;
+            by default only its status fields are kept.
+        use_index (bool): Allow answering from place_index. The scorers turn it
+            off for queries of categories without a sample cap, which average
+            every place the API returns, however far.
+        load (bool): Look up cached results now. Coroutines pass False and
+            use acreate(), which does the SQLite lookups off the event loop.
+    """
+
+    def __init__(self, query, lat, lng, api_key, max_pages=2, max_distance=None, keep_raw=False, use_index=True,
+                 load=True):
+        self.query = query
+        self.lat = lat
+        self.lng = lng
+        self.api_key = api_key
+        self.max_pages = max_pages
+        self.max_distance = max_distance
+        self.keep_raw = keep_raw
+        self.use_index = use_index
+
+        self.key = places_cache_key(query, lat, lng)
+        self.places = []
+        self.page_ends = []
+        self.response_json = {}
+        self.exhausted = False  # the API has no more pages
+        self._page_token = None
+        self._lock = threading.Lock()
+        self._alock = asyncio.Lock()
+
+        if load:
+            self._load()
+
+    @classmethod
+    async def acreate(cls, *args, **kwargs):
+        """LazyPlaces(...) for the aio loop: the store and index lookups run in a worker thread."""
+        places = cls(*args, load=False, **kwargs)
+        await asyncio.to_thread(places._load)
+        return places
+
+    def _load(self):
+        """Fill in the results from places_cache / places_store, or from place_index."""
+        max_pages = self.max_pages
+
+        with metrics.span('places_cache_lookup'):
+            cached = places_cache.get(self.key)
+            if cached is None and places_store is not None:
+                cached = places_store.get(self.key)
+                if cached is not None:
+                    places_cache.set(self.key, cached)
+        metrics.count_lookup('places', cached is not None)
+
+        if cached is not None:
+            self.page_ends = cached['page_ends'][:max_pages]
+            self.places = [Place.from_record(record) for record in cached['places'][:self.page_ends[-1]]]
+            self.response_json = _response_summary(cached['response_json'])
+            self.exhausted = cached['complete'] and len(cached['page_ends']) <= max_pages
+        elif place_index is not None and self.use_index:
+            with metrics.span('place_index_lookup'):
+                found = place_index.lookup(normalize_query(self.query), self.lat, self.lng, k=max_pages * 20,
+                                           radius_km=self.max_distance or PLACE_INDEX_RADIUS_KM,
+                                           min_places=PLACE_INDEX_MIN_PLACES, search_km=PLACE_INDEX_SEARCH_KM)
+            metrics.count_lookup('place_index', found is not None)
+            if found is not None:
+                self.places = [Place.from_record(record) for _, record in found]
+                self.page_ends = [len(self.places)]
+                self.response_json = {'status': 'OK'}
+                self.exhausted = True
+
+    def __repr__(self):
+        return f"LazyPlaces({self.query!r}, {len(self.places)} places, {len(self.page_ends)} pages)"
+
+    def _params(self):
+        return {
+            "query": self.query,
+            "location": f"{self.lat},{self.lng}",
+            "rankby": "distance",
+            "key": self.api_key
+        }
+
+    def _can_fetch(self):
+        if self.exhausted or len(self.page_ends) >= self.max_pages:
+            return False
+        if self.max_distance is not None and self.places:
+            last = self.places[-1]
+            if last.lat is not None and \
+                    haversine_distance(self.lat, self.lng, last.lat, last.lng) > self.max_distance:
+                return False
+        return True
+
+    def _request_page(self, page_token):
+        client = get_places_client()
+        with metrics.span('places_page', page='next' if page_token else 'first'):
+            if page_token:
+                # Polls until the token becomes active instead of sleeping a fixed 5s
+                return client.text_search_page(self._params(), page_token)
+            return client.text_search(self._params())
+
+    async def _arequest_page(self, page_token):
+        client = get_async_places_client()
+        with metrics.span('places_page', page='next' if page_token else 'first'):
+            if page_token:
+                return await client.text_search_page(self._params(), page_token)
+            return await client.text_search(self._params())
+
+    def _add_page(self, response_json):
+        """Add a fetched page to the results. Returns how many places it had."""
+        results = response_json.get("results", [])
+        for place in results:
+            self.places.append(Place.from_result(place))
+
+        self.page_ends.append(len(self.places))
+        self.response_json = response_json if self.keep_raw else _response_summary(response_json)
+        self._page_token = response_json.get("next_page_token")
+        self.exhausted = not self._page_token
+        return len(results)
+
+    def _save_page(self, response_json, n_new):
+        """Write the results so far to the caches, and the new page to place_index."""
+        if response_json.get("status") in ("OK", "ZERO_RESULTS"):
+            entry = {'places': [place.to_record() for place in self.places],
+                     'response_json': _response_summary(response_json),
+                     'page_ends': list(self.page_ends),
+                     'complete': self.exhausted}
+            places_cache.set(self.key, entry)
+            if places_store is not None:
+                places_store.set(self.key, entry)
+            if place_index is not None:
+                self._index_page(n_new)
+
+    def _index_page(self, n_new):
+        # The search covered everything, or out to the farthest place fetched
+        reach = None
+        if not self.exhausted:
+            dists = place_distances(self.lat, self.lng, self.places)
+            reach = float(np.nanmax(dists)) if np.isfinite(dists).any() else 0.0
+        page = self.places[len(self.places) - n_new:]
+        place_index.add(normalize_query(self.query), self.lat, self.lng,
+                        [(p.place_id, p.name, p.lat, p.lng, p.to_record()) for p in page], reach_km=reach)
+
+    def _walk(self):
+        """
+        The requests behind fetch_next_page, shared with afetch_next_page:
+        yields each page token to request (None for the first page), is sent
+        the response, and returns the next page's response, or None when
+        nothing more will come.
+        """
+        if not self._can_fetch():
+            return None
+
+        page_token = self._page_token
+        if self.page_ends and not page_token:
+            # Earlier pages came from the cache, whose tokens have long
+            # expired; walk the chain again up to the page we need.
+            response_json = yield None
+            for _ in range(len(self.page_ends) - 1):
+                page_token = response_json.get("next_page_token")
+                if not page_token:
+                    break
+                response_json = yield page_token
+            page_token = response_json.get("next_page_token")
+            if not page_token:
+                self.exhausted = True
+                return None
+
+        return (yield page_token)
+
+    def fetch_next_page(self):
+        """Fetch one more page if allowed. Returns False when nothing more will come."""
+        with self._lock:
+            walk = self._walk()
+            try:
+                page_token = next(walk)
+                while True:
+                    page_token = walk.send(self._request_page(page_token))
+            except StopIteration as done:
+                response_json = done.value
+
+            if response_json is None:
+                return False
+            self._save_page(response_json, self._add_page(response_json))
+            return True
+
+    async def afetch_next_page(self):
+        """fetch_next_page for the aio loop, through the async Places client; cache writes run in a worker thread."""
+        async with self._alock:
+            walk = self._walk()
+            try:
+                page_token = next(walk)
+                while True:
+                    page_token = walk.send(await self._arequest_page(page_token))
+            except StopIteration as done:
+                response_json = done.value
+
+            if response_json is None:
+                return False
+            await asyncio.to_thread(self._save_page, response_json, self._add_page(response_json))
+            return True
+
+    def prefetch(self):
+        """Make sure the first page is loaded, from the cache or the API."""
+        if not self.page_ends:
+            self.fetch_next_page()
+        return self
+
+    async def aprefetch(self):
+        if not self.page_ends:
+            await self.afetch_next_page()
+        return self
+
+    async def afetch_all(self):
+        """Fetch every page allowed by max_pages and max_distance."""
+        while await self.afetch_next_page():
+            pass
+        return self
+
+    def iter_pages(self, fetch=True):
+        """
+        Yield the results one page (list of Places) at a time. With
+        fetch=False, stop after the pages already fetched.
+        """
+        start = 0
+        page = 0
+        while True:
+            while page < len(self.page_ends):
+                yield self.places[start:self.page_ends[page]]
+                start = self.page_ends[page]
+                page += 1
+            if not fetch or not self.fetch_next_page():
+                return
+
+    def __iter__(self):
+        for page in self.iter_pages():
+            yield from page
+
+
+def search_places(query, lat, lng, radius, api_key, max_pages=2, max_distance=None, max_results=None,
+                  keep_raw=False):
     """
     Search places using Google Places Text Search API.
 
+    Fetches pages until max_results places are collected (or every page up
+    to max_pages); use LazyPlaces to pull pages on demand. Cached results for
+    the same query and cell, including ones fetched by the scorers, are
+    reused.
+
     Parameters:
         query (str): Search query (e.g., "hospital").
         lat (float): Latitude.
         lng (float): Longitude.
         radius (int): Search radius in meters.
         api_key (str): Your Google Maps API key.
-        max_pages (int): Max number of paginated result pages to fetch (default is 3).
+        max_pages (int): Max number of paginated result pages to fetch (default is 2).
+        max_distance (float): Stop paging past this distance in km (default no cutoff).
+        max_results (int): Stop once this many places are collected (default no limit).
+        keep_raw (bool): Return the last page's full API response instead of its status fields.
 
     Returns:
-        List[dict]: List of places with name, address, location, and rating info.
+        List[Place]: Places with name, address, location, and rating info, and the response json.
     """
 
-    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
-    all_results = []
-    page_token = None
+    results = LazyPlaces(query, lat, lng, api_key, max_pages=max_pages, max_distance=max_distance,
+                         keep_raw=keep_raw)
+    all_results = list(itertools.islice(results, max_results))
 
-    for _ in range(max_pages):
-        params = {
-            "query": query,
-            "location": f"{lat},{lng}",
-            "rankby": "distance",
-            "key": api_key
-        }
-        if page_token:
-            params["pagetoken"] = page_token
-            time.sleep(5)  # Required delay before next_page_token becomes active
+    return all_results, results.response_json
 
-        response = requests.get(url, params=params)
-        response_json = response.json()
 
-        results = response_json.get("results", [])
-        for place in results:
-            all_results.append({
-                "name": place.get("name"),
-                "address": place.get("formatted_address"),
-                "lat": place.get("geometry", {}).get("location", {}).get("lat"),
-                "lng": place.get("geometry", {}).get("location", {}).get("lng"),
-                "rating": place.get("rating"),
-                "user_ratings_total": place.get("user_ratings_total")
-            })
+async def search_places_async(query, lat, lng, radius, api_key, max_pages=2, max_distance=None, max_results=None,
+                              keep_raw=False):
+    """search_places for the aio loop: same arguments and return value."""
 
-        page_token = response_json.get("next_page_token")
-        if not page_token:
-            break
+    results = await LazyPlaces.acreate(query, lat, lng, api_key, max_pages=max_pages, max_distance=max_distance,
+                                       keep_raw=keep_raw)
+    while (max_results is None or len(results.places) < max_results) and await results.afetch_next_page():
+        pass
 
-    return all_results, response_json
+    return results.places[:max_results], results.response_json
 
 
-def run_search(q_latitude, q_longitude, query_key):
+def nearby_places(query, lat, lng, k=10, radius_km=5):
+    """
+    The k nearest places already fetched for query within radius_km of
+    (lat, lng), as (Place, distance km) pairs, nearest first. Answered from
+    place_index alone; the API is never called.
+    """
+    if place_index is None:
+        return []
+    found = place_index.nearest(normalize_query(query), lat, lng, k=k, radius_km=radius_km)
+    return [(Place.from_record(record), distance) for distance, record in found]
+
+
+def run_search(q_latitude, q_longitude, query_key, max_pages=2, max_distance=None, keep_raw=False, use_index=True):
+    """
+    Start a search for each query and return {query: [LazyPlaces, first page json]}.
+
+    First pages are fetched concurrently; later pages are only requested if
+    the caller iterates that far. max_distance is a cutoff in km, or a dict
+    of cutoffs per query; use_index likewise a flag or a dict of flags. The
+    json is the page's status fields unless keep_raw is set.
+    """
 
     API_KEY = os.getenv('google_place_api_key')
     radius = 1
@@ -86,17 +574,23 @@ def run_search(q_latitude, q_longitude, query_key):
     # for query_key in query_dict.keys():
     # for query_key in [query_key]:
     # query_values = query_dict.get(query_key, [])
-    print('query_key: ', query_key)
     
     if type(query_key) == str:
         query_values = [query_key]
     else:
         query_values = query_key
 
+    futures = {}
     for query_str in query_values:
-        print('query_str: ', query_str)
-        places, response_json= search_places(query_str, q_latitude, q_longitude, radius, API_KEY)
-        query_output_dict[query_str] = [places, response_json]
+        cutoff = max_distance.get(query_str) if isinstance(max_distance, dict) else max_distance
+        indexed = use_index.get(query_str, True) if isinstance(use_index, dict) else use_index
+        places = LazyPlaces(query_str, q_latitude, q_longitude, API_KEY,
+                            max_pages=max_pages, max_distance=cutoff, keep_raw=keep_raw, use_index=indexed)
+        futures[query_str] = _submit_places(places.prefetch)
+
+    for query_str, future in futures.items():
+        places = future.result()
+        query_output_dict[query_str] = [places, places.response_json]
 
     return query_output_dict
 
@@ -108,16 +602,6 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     """
     R = 6371  # Earth radius in km
 
-    abs_diff = abs(lat1 - lat2)
-    if abs_diff> 10:
-        x = lat1
-        lat1 = lat2
-        lat2 = x
-
-        x = lon1
-        lon1 = lon2
-        lon2 = x 
-
     d_lat = math.radians(lat2 - lat1)
     d_lon = math.radians(lon2 - lon1)
 
@@ -132,645 +616,398 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     return distance
 
 
+def haversine_many(lat, lng, lats, lngs):
+    """
+    Distances in km from one origin to many points in a single vectorized call.
 
+    Parameters:
+        lat, lng (float): Origin.
+        lats, lngs (array-like): Point coordinates; None/NaN give NaN distances.
 
-def get_rental_availability(q_latitude, q_longitude):
-
-    query_str = query_dict.get('Rental Availability', [])
-    print('query_str:', query_str)
-    query_output_dict = run_search(q_latitude, q_longitude, query_str)
-    print('query_output_dict:', str(query_output_dict)[:100])
-
-    results =query_output_dict[query_str][0]
-
-    stars = -1
-    distance_sum = -1
-    distance_counter = -1
-    top_rating = -99
-    top_place = ''
-
-
-    for place in results:
-        # print(place)
-        lat= place.get("lat")
-        lng= place.get("lng")
-        dist = haversine_distance(q_latitude, q_longitude, lat, lng)
-        # print(lat, lng)
-        
-        # print(f"Distance: {dist:.2f} km")
-        # print('\n')
-
-        if (distance_sum == -1) & (dist> 0):
-            distance_sum = dist
-            distance_counter = 1
-
-        if (distance_sum > 0) & (dist> 0):
-            distance_sum = distance_sum + dist
-            distance_counter = distance_counter+ 1
-
-        ratings = place.get("rating", -99)
-        if (ratings is not None): 
-            if (ratings > top_rating):
-                top_rating = ratings
-                top_place = place.get('name')
-
-        if distance_counter >= 10:
-            break
-
-
-    wt_distance = distance_sum/distance_counter
-    # print(distance_sum, distance_counter, wt_distance)
-
-    if distance_counter >= 10:
-        if wt_distance <= 1.5:
-            return [5, top_place, top_rating]
-        if wt_distance <= 3:
-            return [4, top_place, top_rating]
-        if wt_distance <= 5:
-            return [3, top_place, top_rating]
-        if wt_distance <= 10:
-            return [2, top_place, top_rating]
-        if wt_distance <= 20:
-            return [1, top_place, top_rating]
-    else :
-        return [2, top_place, top_rating]
-    
-
-def get_safety(q_latitude, q_longitude):
-
-    # print(q_latitude, q_longitude)
-    query_str = 'police stations near me'
-    query_output_dict = run_search(q_latitude, q_longitude, query_str)
-
-
-    results =query_output_dict[query_str][0]
-
-    stars = -1
-    distance_sum = -1
-    distance_counter = -1
-    top_rating = -99
-    top_place = ''
-
+    Returns:
+        np.ndarray: Distances, shape (n_points,).
+    """
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    return haversine_np(lat, lng, lats, lngs)
 
-    for place in results:
-        # print(place)
-        lat= place.get("lat")
-        lng= place.get("lng")
-        dist = haversine_distance(q_latitude, q_longitude, lat, lng)
-        # print(lat, lng)
-        
-        # print(f"Distance: {dist:.2f} km")
-        # print('\n')
 
-        if (distance_sum == -1) & (dist> 0):
-            distance_sum = dist
-            distance_counter = 1
+def haversine_matrix(origin_lats, origin_lngs, lats, lngs):
+    """
+    Distances in km from every origin to every point.
 
-        if (distance_sum > 0) & (dist> 0):
-            distance_sum = distance_sum + dist
-            distance_counter = distance_counter+ 1
+    Returns:
+        np.ndarray: Distances, shape (n_origins, n_points).
+    """
+    origin_lats = np.asarray(origin_lats, dtype=float)[:, None]
+    origin_lngs = np.asarray(origin_lngs, dtype=float)[:, None]
+    lats = np.asarray(lats, dtype=float)[None, :]
+    lngs = np.asarray(lngs, dtype=float)[None, :]
+    return haversine_np(origin_lats, origin_lngs, lats, lngs)
 
 
-        ratings = place.get("rating", -99)
-        if (ratings is not None):
-            if (ratings > top_rating):
-                top_rating = ratings
-                top_place = place.get('name')
+def place_distances(q_latitude, q_longitude, places):
+    """Distances in km from the origin to each place."""
+    return haversine_many(q_latitude, q_longitude,
+                          [place.lat for place in places],
+                          [place.lng for place in places])
 
 
-        if distance_counter >= 4:
-                break
+def _iter_pages(results):
+    if isinstance(results, LazyPlaces):
+        return results.iter_pages()
+    return [results]
 
 
-    wt_distance = distance_sum/distance_counter
-    print(distance_sum, distance_counter, wt_distance)
+def _iter_fetched_pages(results):
+    if isinstance(results, LazyPlaces):
+        return results.iter_pages(fetch=False)
+    return [results]
 
-    if (distance_counter >= 3) & (wt_distance <= 5):
-        return [5, top_place, top_rating]
-    if (distance_counter >= 1) & (wt_distance <= 5):
-        return [4, top_place, top_rating]
-    if (wt_distance <= 10):
-        return [3, top_place, top_rating]
-    if (wt_distance <= 20):
-        return [2, top_place, top_rating]
-    if (wt_distance <= 50):
-        return [1, top_place, top_rating]
-    if (distance_counter == -1):
-        return [0, top_place, top_rating]
-    
 
+def _fetch_all_pages(results):
+    for _ in _iter_pages(results):
+        pass
 
-def get_connectivity(q_latitude, q_longitude):
 
-    # print(q_latitude, q_longitude)
+class _PageNeeded(Exception):
+    """Raised by _iter_pages_or_raise when scoring needs a page that is not fetched yet."""
 
-    distance_sum = -1
-    place_counter = -1
-    top_rating = -99
-    top_place = ''
+    def __init__(self, places):
+        super().__init__(places.query)
+        self.places = places
 
-    query_str = 'Connectivity'
-    query_list = query_dict.get(query_str, [])
-    query_output_dict = run_search(q_latitude, q_longitude, query_list)
 
+def _iter_pages_or_raise(results):
+    if not isinstance(results, LazyPlaces):
+        yield results
+        return
+    yield from results.iter_pages(fetch=False)
+    if results._can_fetch():
+        raise _PageNeeded(results)
 
 
-    for query_str in query_list:
-        try:
-            results =query_output_dict[query_str][0]
-        except:
-            results = []
+def _take_count(dists, n_before, cap):
+    """
+    How many of a query's places (in result order) a category reads, given
+    n_before places already counted from earlier queries.
+    """
+    if cap is None:
+        return len(dists)
+    if n_before >= cap - 1:
+        # The cap was reached on an earlier query: only its first place is read
+        return min(1, len(dists))
 
-        for place in results:
-            # print(place)
-            lat= place.get("lat")
-            lng= place.get("lng")
-            dist = haversine_distance(q_latitude, q_longitude, lat, lng)
-            # print(lat, lng)
-            
-            # print(f"Distance: {dist:.2f} km")
-            # print('\n')
-
-            if (distance_sum == -1) & (dist> 0):
-                distance_sum = dist
-                place_counter = 1
-
-            if (distance_sum > 0) & (dist> 0):
-                distance_sum = distance_sum + dist
-                place_counter = place_counter+ 1
-
-            ratings = place.get("rating", -99)
-            if (ratings is not None):
-                if (ratings > top_rating):
-                    top_rating = ratings
-                    top_place = place.get('name')
-
-
-            if place_counter >= 10:
-                break
-
-
-    wt_distance = distance_sum/place_counter
-    # print(distance_sum, place_counter, wt_distance)
-
-    if (place_counter >= 10) & (wt_distance <= 2):
-        return [5, top_place, top_rating]
-    if (place_counter >= 10) & (wt_distance <= 5):
-        return [4, top_place, top_rating]
-    if (place_counter >= 5) & (wt_distance <= 10):
-        return [3, top_place, top_rating]
-    if (place_counter >= 2) & (wt_distance <= 10):
-        return [2, top_place, top_rating]
-    if (place_counter >= 1) & (wt_distance <= 10):
-        return [1, top_place, top_rating]
-    if (place_counter == -1):
-        return [0, top_place, top_rating]
-    else:
-        return [0, top_place, top_rating]
-    
-def get_entertainment(q_latitude, q_longitude):
+    counted = np.cumsum(dists > 0)
+    hit = np.nonzero(counted >= cap - 1 - n_before)[0]
+    if len(hit):
+        return int(hit[0]) + 1
+    return len(dists)
 
-    # print(q_latitude, q_longitude)
 
-    distance_sum = -1
-    place_counter = -1
-    top_rating = -99
-    top_place = ''
+def _score_spec(spec, q_latitude, q_longitude, query_output_dict, page_distances, iter_pages=_iter_pages):
+    """
+    Score one category from its queries' results.
 
-    query_str = 'Entertainment'
-    query_list = query_dict.get(query_str, [])
-    query_output_dict = run_search(q_latitude, q_longitude, query_list)
+    page_distances maps (query, page number) -> distances already computed
+    for that page; pages fetched on demand here are computed and added.
+    iter_pages yields a query's result pages, fetching more as needed.
+    """
+    cap = spec['sample_cap']
+    dists = []
+    ratings = []
+    names = []
+    n_counted = 0
 
-    for query_str in query_list:
+    for query_str in spec['queries']:
         try:
-            results =query_output_dict[query_str][0]
-        except:
+            results = query_output_dict[query_str][0]
+        except (KeyError, IndexError, TypeError):
             results = []
 
-        for place in results:
-            # print(place)
-            lat= place.get("lat")
-            lng= place.get("lng")
-            dist = haversine_distance(q_latitude, q_longitude, lat, lng)
-            # print(lat, lng)
-            
-            # print(f"Distance: {dist:.2f} km")
-            # print('\n')
-
-            if (distance_sum == -1) & (dist> 0):
-                distance_sum = dist
-                place_counter = 1
-
-            if (distance_sum > 0) & (dist> 0):
-                distance_sum = distance_sum + dist
-                place_counter = place_counter+ 1
-
-            ratings = place.get("rating", -99)
-            if (ratings is not None):
-                if (ratings > top_rating):
-                    top_rating = ratings
-                    top_place = place.get('name')
-
-
-            print('query_str:')
-            print(distance_sum, place_counter)  
-
-            if place_counter >= 10:
-                break
-
-
-    wt_distance = distance_sum/place_counter
-    print('Final:')
-    print(distance_sum, place_counter, wt_distance)
-
-    if (place_counter >= 10) & (wt_distance <= 2):
-        return [5, top_place, top_rating]
-    if (place_counter >= 10) & (wt_distance <= 5):
-        return [4, top_place, top_rating]
-    if (place_counter >= 5) & (wt_distance <= 10):
-        return [3, top_place, top_rating]
-    if (place_counter >= 2) & (wt_distance <= 10):
-        return [2, top_place, top_rating]
-    if (place_counter >= 1) & (wt_distance <= 10):
-        return [1, top_place, top_rating]
-    if (place_counter == -1):
-        return [0, top_place, top_rating]
+        query_dists = np.empty(0)
+        query_places = []
+        take = 0
+        for page_no, page in enumerate(iter_pages(results)):
+            if (query_str, page_no) not in page_distances:
+                page_distances[(query_str, page_no)] = place_distances(q_latitude, q_longitude, page)
+            query_dists = np.concatenate([query_dists, page_distances[(query_str, page_no)]])
+            query_places.extend(page)
+
+            take = _take_count(query_dists, n_counted, cap)
+            if take < len(query_dists):
+                break  # the stopping place is already fetched; skip later pages
+
+        take = _take_count(query_dists, n_counted, cap)
+        dists.append(query_dists[:take])
+        for place in query_places[:take]:
+            ratings.append(place.rating)
+            names.append(place.name)
+        n_counted += int(np.count_nonzero(query_dists[:take] > 0))
+
+    dists = np.concatenate(dists) if dists else np.empty(0)
+    counted = dists[dists > 0]
+
+    # The original per-category loops seeded the running sum with the first
+    # counted place and then counted it again; kept so scores do not shift.
+    if len(counted):
+        distance_sum = counted.sum() + counted[0]
+        place_counter = len(counted) + 1
     else:
-        return [0, top_place, top_rating]
-    
+        distance_sum = -1
+        place_counter = -1
+    wt_distance = distance_sum / place_counter
 
-def get_education(q_latitude, q_longitude):
-
-    # print(q_latitude, q_longitude)
-
-    distance_sum = -1
-    place_counter = -1
     top_rating = -99
     top_place = ''
-    
-    query_str = 'Education'
-    query_list = query_dict.get(query_str, [])
-    query_output_dict = run_search(q_latitude, q_longitude, query_list)
+    rating_values = np.array([np.nan if r is None else r for r in ratings], dtype=float)
+    if len(rating_values) and not np.all(np.isnan(rating_values)):
+        best = int(np.nanargmax(rating_values))
+        if rating_values[best] > top_rating:
+            top_rating = ratings[best]
+            top_place = names[best]
 
-    print('Inside Education:')
-    print(query_output_dict)
-    print('\n\n')
-    
-
-    for query_str in query_list:
-        try:
-            print('Inside Education:')
-            print(query_output_dict[query_str])
-            print('\n\n')
+    for min_count, max_distance, score in spec['ladder']:
+        if (min_count is None or place_counter >= min_count) and wt_distance <= max_distance:
+            return [score, top_place, top_rating]
+    return [spec['default'], top_place, top_rating]
 
-            print('Inside Education:')
-            print(query_output_dict[query_str][0])
-            print('\n\n')
 
-            results =query_output_dict[query_str][0]
-        except:
-            results = []
+def _spec_max_distance(spec):
+    # A math.inf row scores whatever lies beyond the other rows; it is no reason to page further
+    return max(max_distance for _, max_distance, _ in spec['ladder'] if max_distance != math.inf)
 
-        for place in results:
-            print(place.get('name'))
-            lat= place.get("lat")
-            lng= place.get("lng")
-
-            dist = haversine_distance(q_latitude, q_longitude, lat, lng)
-            print('Indise place in results loop:', lat, lng)
-            
-            # print(f"Distance: {dist:.2f} km")
-            # print('\n')
-
-            if (distance_sum == -1) & (dist> 0):
-                distance_sum = dist
-                place_counter = 1
-
-            if (distance_sum > 0) & (dist> 0):
-                distance_sum = distance_sum + dist
-                place_counter = place_counter+ 1
-
-            ratings = place.get("rating", -99)
-            if (ratings is not None):
-                if (ratings > top_rating):
-                    top_rating = ratings
-                    top_place = place.get('name')
-
-
-            if place_counter >= 10:
-                break
-
-            print(distance_sum, place_counter)
-
-
-    wt_distance = distance_sum/place_counter
-    print(distance_sum, place_counter, wt_distance)
-
-    if (place_counter >= 10) & (wt_distance <= 10):
-        return [5, top_place, top_rating]
-    if (place_counter >= 7) & (wt_distance <= 20):
-        return [4, top_place, top_rating]
-    if (place_counter >= 5) & (wt_distance <= 20):
-        return [3, top_place, top_rating]
-    if (place_counter >= 2) & (wt_distance <= 20):
-        return [2, top_place, top_rating]
-    if (place_counter >= 1) & (wt_distance <= 20):
-        return [1, top_place, top_rating]
-    if (place_counter == -1):
-        return [0, top_place, top_rating]
-    else:
-        return [0, top_place, top_rating]
-    
 
+def _query_cutoffs(categories):
+    """
+    query -> paging cutoff in km, or None for no cutoff. A query shared by
+    several categories is searched once, with the widest cutoff.
 
-def get_environment(q_latitude, q_longitude):
+    Categories without a sample cap average over every place their queries
+    return, near or far, so their queries are never cut off.
+    """
+    max_distance = {}
+    for category in categories:
+        spec = category_specs[category]
+        for query_str in spec['queries']:
+            if spec['sample_cap'] is None or max_distance.get(query_str, 0) is None:
+                max_distance[query_str] = None
+            else:
+                max_distance[query_str] = max(max_distance.get(query_str, 0), _spec_max_distance(spec))
+    return max_distance
+
+
+def _category_searches(categories):
+    """
+    What scoring categories has to search: the categories (every enabled one
+    when None), the query -> cutoff dict from _query_cutoffs, and the queries
+    read in full because a category using them has no sample cap.
+    """
+    if categories is None:
+        categories = [c for c, spec in category_specs.items() if spec['enabled']]
+    uncapped = {q for c in categories if category_specs[c]['sample_cap'] is None
+                for q in category_specs[c]['queries']}
+    return categories, _query_cutoffs(categories), uncapped
 
-    # print(q_latitude, q_longitude)
 
-    distance_sum = -1
-    place_counter = -1
-    top_rating = -99
-    top_place = ''
+def score_categories(q_latitude, q_longitude, categories=None):
+    """
+    Score several categories in one pass.
 
-    query_str = 'Environment'
-    query_list = query_dict.get(query_str, [])
-    query_output_dict = run_search(q_latitude, q_longitude, query_list)
+    All their queries are searched at once, distances for every fetched place
+    are computed in a single vectorized call, and each category then reads
+    only as many places (and pages) as its spec needs.
 
+    Returns:
+        dict: category -> [score, top_place, top_rating]
+    """
+    categories, max_distance, uncapped = _category_searches(categories)
+    query_output_dict = run_search(q_latitude, q_longitude, list(max_distance), max_distance=max_distance,
+                                   use_index={q: q not in uncapped for q in max_distance})
+
+    # Categories without a sample cap read every page, so pull those now, in parallel
+    futures = [_submit_places(_fetch_all_pages, query_output_dict[q][0]) for q in uncapped]
+    for future in futures:
+        future.result()
+
+    page_distances = _fetched_page_distances(q_latitude, q_longitude, query_output_dict)
+
+    rounds = _score_rounds(categories, q_latitude, q_longitude, query_output_dict, page_distances)
+    try:
+        needed = next(rounds)
+        while True:
+            futures = [_submit_places(places.fetch_next_page) for places in needed]
+            for future in futures:
+                future.result()
+            needed = next(rounds)
+    except StopIteration as done:
+        return done.value
+
+
+async def score_categories_async(q_latitude, q_longitude, categories=None):
+    """
+    score_categories for the aio loop. Searches and the pages the scoring
+    rounds need run as coroutines on the async Places client, so pages
+    requested match the sync path.
+    """
+    categories, cutoffs, uncapped = _category_searches(categories)
+    api_key = os.getenv('google_place_api_key')
 
-    for query_str in query_list:
-        try:
-            results =query_output_dict[query_str][0]
-        except:
-            results = []
+    query_output_dict = dict.fromkeys(cutoffs)
 
-        for place in results:
-            # print(place.get('name'))
-            lat= place.get("lat")
-            lng= place.get("lng")
-            dist = haversine_distance(q_latitude, q_longitude,  lat, lng)
-            # print(lat, lng)
-            
-            # print(f"Distance: {dist:.2f} km")
-            # print('\n')
-
-            if (distance_sum == -1) & (dist> 0):
-                distance_sum = dist
-                place_counter = 1
-
-            if (distance_sum > 0) & (dist> 0):
-                distance_sum = distance_sum + dist
-                place_counter = place_counter+ 1
-
-            ratings = place.get("rating", -99)
-            if (ratings is not None):
-                if (ratings > top_rating):
-                    top_rating = ratings
-                    top_place = place.get('name')
-
-
-            if place_counter>= 10:
-                break
-
-
-    wt_distance = distance_sum/place_counter
-    # print(distance_sum, place_counter, wt_distance)
-
-    if (place_counter >= 10) & (wt_distance <= 10):
-        return [5, top_place, top_rating]
-    if (place_counter >= 7) & (wt_distance <= 20):
-        return [4, top_place, top_rating]
-    if (place_counter >= 5) & (wt_distance <= 20):
-        return [3, top_place, top_rating]
-    if (place_counter >= 2) & (wt_distance <= 20):
-        return [2, top_place, top_rating]
-    if (place_counter >= 1) & (wt_distance <= 20):
-        return [1, top_place, top_rating]
-    if (place_counter == -1):
-        return [0, top_place, top_rating]
-    else:
-        return [0, top_place, top_rating]
-    
+    async def search(query_str, cutoff):
+        places = await LazyPlaces.acreate(query_str, q_latitude, q_longitude, api_key, max_distance=cutoff,
+                                          use_index=query_str not in uncapped)
+        query_output_dict[query_str] = [places, None]
+        await (places.afetch_all() if query_str in uncapped else places.aprefetch())
 
+    await asyncio.gather(*(search(query_str, cutoff) for query_str, cutoff in cutoffs.items()))
 
-def get_community(q_latitude, q_longitude):
+    page_distances = _fetched_page_distances(q_latitude, q_longitude, query_output_dict)
 
-    print(q_latitude, q_longitude)
+    rounds = _score_rounds(categories, q_latitude, q_longitude, query_output_dict, page_distances)
+    try:
+        needed = next(rounds)
+        while True:
+            await asyncio.gather(*(places.afetch_next_page() for places in needed))
+            needed = next(rounds)
+    except StopIteration as done:
+        return done.value
 
-    distance_sum = -1
-    place_counter = -1
-    top_rating = -99
-    top_place = ''
 
-    query_str = 'Community and Culture'
-    query_list = query_dict.get(query_str, [])
-    query_output_dict = run_search(q_latitude, q_longitude, query_list)
+def _score_rounds(categories, q_latitude, q_longitude, query_output_dict, page_distances):
+    """
+    Scoring rounds shared by score_categories and score_categories_async.
+    Each round scores every category still open on the pages fetched so far
+    and yields the LazyPlaces whose next page some category needs; the
+    caller fetches those concurrently before the next round. Returns
+    category -> [score, top_place, top_rating] once no page is needed.
+    """
+    scores = {}
+    open_categories = list(categories)
+    while True:
+        needed = {}
+        for category in open_categories:
+            with metrics.span('score_category', category=category):
+                try:
+                    scores[category] = _score_spec(category_specs[category], q_latitude, q_longitude,
+                                                   query_output_dict, page_distances,
+                                                   iter_pages=_iter_pages_or_raise)
+                except _PageNeeded as e:
+                    needed[id(e.places)] = e.places
+        if not needed:
+            return {category: scores[category] for category in categories}
+        open_categories = [c for c in open_categories if c not in scores]
+        yield list(needed.values())
+
+
+def _fetched_page_distances(q_latitude, q_longitude, query_output_dict):
+    """(query, page number) -> distances, from one vectorized call over every page fetched so far."""
+    page_keys = []
+    pages = []
+    for query_str, (results, _) in query_output_dict.items():
+        for page_no, page in enumerate(_iter_fetched_pages(results)):
+            page_keys.append((query_str, page_no))
+            pages.append(page)
+    all_places = [place for page in pages for place in page]
+    all_dists = place_distances(q_latitude, q_longitude, all_places)
+
+    page_distances = {}
+    start = 0
+    for key, page in zip(page_keys, pages):
+        page_distances[key] = all_dists[start:start + len(page)]
+        start += len(page)
+    return page_distances
+
+
+def iter_scores(q_latitude, q_longitude, categories=None):
+    """
+    Yield (category, [score, top_place, top_rating]) for each category as
+    soon as its own searches are in, fastest category first. A category
+    that needs a page not fetched yet waits for it on the places pool while
+    the others keep scoring.
+    """
+    categories, cutoffs, uncapped = _category_searches(categories)
+    api_key = os.getenv('google_place_api_key')
 
+    query_output_dict = {}
+    searches = {}
+    for query_str, cutoff in cutoffs.items():
+        places = LazyPlaces(query_str, q_latitude, q_longitude, api_key, max_distance=cutoff,
+                            use_index=query_str not in uncapped)
+        query_output_dict[query_str] = [places, None]
+        fetch = _fetch_all_pages if query_str in uncapped else LazyPlaces.prefetch
+        searches[query_str] = _submit_places(fetch, places)
+
+    # category -> futures it waits for; one page fetch in flight per LazyPlaces
+    waiting = {c: {searches[q] for q in category_specs[c]['queries']} for c in categories}
+    page_fetches = {}
+    page_distances = {}
+    while waiting:
+        done, _ = wait(set().union(*waiting.values()), return_when=FIRST_COMPLETED)
+        for future in done:
+            future.result()
+        for places_id in [k for k, future in page_fetches.items() if future in done]:
+            del page_fetches[places_id]
+
+        for category in list(waiting):
+            waiting[category] -= done
+            if waiting[category]:
+                continue
+            with metrics.span('score_category', category=category):
+                try:
+                    result = _score_spec(category_specs[category], q_latitude, q_longitude,
+                                         query_output_dict, page_distances, iter_pages=_iter_pages_or_raise)
+                except _PageNeeded as e:
+                    if id(e.places) not in page_fetches:
+                        page_fetches[id(e.places)] = _submit_places(e.places.fetch_next_page)
+                    waiting[category] = {page_fetches[id(e.places)]}
+                    continue
+            del waiting[category]
+            yield category, result
+
+
+def score_category(category, q_latitude, q_longitude):
+    return score_categories(q_latitude, q_longitude, [category])[category]
 
-    for query_str in query_list:
-        try:
-            results =query_output_dict[query_str][0]
-        except:
-            results = []
 
-        for place in results:
-            # print(place.get('name'))
-            lat= place.get("lat")
-            lng= place.get("lng")
-            dist = haversine_distance(q_latitude, q_longitude, lat, lng)
-            # print(lat, lng)
-            
-            # print(f"Distance: {dist:.2f} km")
-            # print('\n')
-
-            if (distance_sum == -1) & (dist> 0):
-                distance_sum = dist
-                place_counter = 1
-
-            if (distance_sum > 0) & (dist> 0):
-                distance_sum = distance_sum + dist
-                place_counter = place_counter+ 1
-
-            ratings = place.get("rating", -99)
-            if (ratings is not None):
-                if (ratings > top_rating):
-                    top_rating = ratings
-                    top_place = place.get('name')
-
-            # print(distance_sum, place_counter)
-
-
-    wt_distance = distance_sum/place_counter
-    # print(distance_sum, place_counter, wt_distance)
-
-    if (place_counter >= 10) & (wt_distance <= 3):
-        return [5, top_place, top_rating]
-    if (place_counter >= 7) & (wt_distance <= 5):
-        return [4, top_place, top_rating]
-    if (place_counter >= 5) & (wt_distance <= 10):
-        return [3, top_place, top_rating]
-    if (place_counter >= 2) & (wt_distance <= 20):
-        return [2, top_place, top_rating]
-    if (place_counter >= 1) & (wt_distance <= 20):
-        return [1, top_place, top_rating]
-    if (place_counter == -1):
-        return [0, top_place, top_rating]
-    else:
-        return [0, top_place, top_rating]
-    
+def get_rental_availability(q_latitude, q_longitude):
+    return score_category('Rental Availability', q_latitude, q_longitude)
 
 
-def get_d_c_infra(q_latitude, q_longitude):
+def get_safety(q_latitude, q_longitude):
+    return score_category('Safety', q_latitude, q_longitude)
 
-    # print(q_latitude, q_longitude)
 
-    distance_sum = -1
-    place_counter = -1
-    top_rating = -99
-    top_place = ''
-    
-    
-    query_str = 'Digital & Civic Infrastructure'
-    query_list = query_dict.get(query_str, [])
-    query_output_dict = run_search(q_latitude, q_longitude, query_list)
+def get_connectivity(q_latitude, q_longitude):
+    return score_category('Connectivity', q_latitude, q_longitude)
 
 
-    for query_str in query_list:
-        try:
-            results =query_output_dict[query_str][0]
-        except:
-            results = []
+def get_entertainment(q_latitude, q_longitude):
+    return score_category('Entertainment', q_latitude, q_longitude)
 
-        for place in results:
-            # print(place.get('name'))
-            lat= place.get("lat")
-            lng= place.get("lng")
-            dist = haversine_distance(q_latitude, q_longitude,  lat, lng)
-            # print(lat, lng)
-            
-            # print(f"Distance: {dist:.2f} km")
-            # print('\n')
-
-            if (distance_sum == -1) & (dist> 0):
-                distance_sum = dist
-                place_counter = 1
-
-            if (distance_sum > 0) & (dist> 0):
-                distance_sum = distance_sum + dist
-                place_counter = place_counter+ 1
-
-            ratings = place.get("rating", -99)
-            if (ratings is not None):
-                if (ratings > top_rating):
-                    top_rating = ratings
-                    top_place = place.get('name')
-
-
-    wt_distance = distance_sum/place_counter
-    # print(distance_sum, place_counter, wt_distance)
-
-    if (place_counter >= 3) & (wt_distance <= 10):
-        return [5, top_place, top_rating]
-    if (place_counter >= 3) & (wt_distance <= 20):
-        return [4, top_place, top_rating]
-    if (place_counter >= 3) & (wt_distance <= 30):
-        return [3, top_place, top_rating]
-    if (place_counter >= 2) & (wt_distance <= 30):
-        return [2, top_place, top_rating]
-    if (place_counter >= 1) & (wt_distance <= 30):
-        return [1, top_place, top_rating]
-    if (place_counter == -1):
-        return [0, top_place, top_rating]
-    else:
-        return [0, top_place, top_rating]
-    
 
-def get_employment(q_latitude, q_longitude):
+def get_education(q_latitude, q_longitude):
+    return score_category('Education', q_latitude, q_longitude)
 
-    # print(q_latitude, q_longitude)
 
-    distance_sum = -1
-    place_counter = -1
-    top_rating = -99
-    top_place = ''
+def get_environment(q_latitude, q_longitude):
+    return score_category('Environment', q_latitude, q_longitude)
 
-    query_str = 'Employment Opportunities'
-    query_list = query_dict.get(query_str, [])
-    query_output_dict = run_search(q_latitude, q_longitude, query_list)
 
-    print('\n')    
-    print(query_output_dict)
-    print('\n')
+def get_community(q_latitude, q_longitude):
+    return score_category('Community and Culture', q_latitude, q_longitude)
 
 
-    
+def get_d_c_infra(q_latitude, q_longitude):
+    return score_category('Digital & Civic Infrastructure', q_latitude, q_longitude)
 
-    for query_str in query_list:
-        try:
-            print('just str \n')    
-            print(query_output_dict[query_str])
-            print('\n')
-            
-            
-            print(' str + 1 \n')    
-            print(query_output_dict[query_str][0])
-            print('\n')
-
-            print(' final \n')    
-            print(query_output_dict[query_str][0])
-            print('\n')
-
-            results =query_output_dict[query_str][0]
-        except:
-            results = []
 
-        for place in results:
-            # print(place.get('name'))
-            lat= place.get("lat")
-            lng= place.get("lng")
-            dist = haversine_distance(q_latitude, q_longitude,  lat, lng)
-            # print(lat, lng)
-            
-            # print(f"Distance: {dist:.2f} km")
-            # print('\n')
-
-            if (distance_sum == -1) & (dist> 0):
-                distance_sum = dist
-                place_counter = 1
-
-            if (distance_sum > 0) & (dist> 0):
-                distance_sum = distance_sum + dist
-                place_counter = place_counter+ 1
-
-            ratings = place.get("rating", -99)
-            if (ratings is not None):
-                if (ratings > top_rating):
-                    top_rating = ratings
-                    top_place = place.get('name')
-
-
-    wt_distance = distance_sum/place_counter
-    # print(distance_sum, place_counter, wt_distance)
-
-    if (place_counter >= 10) & (wt_distance <= 30):
-        return [5, top_place, top_rating]
-    if (place_counter >= 5) & (wt_distance <= 30):
-        return [4, top_place, top_rating]
-    if (place_counter >= 5) & (wt_distance <= 50):
-        return [3, top_place, top_rating]
-    if (place_counter >= 2) & (wt_distance <= 50):
-        return [2, top_place, top_rating]
-    if (place_counter >= 1) & (wt_distance <= 50):
-        return [1, top_place, top_rating]
-    if (place_counter == -1):
-        return [0, top_place, top_rating]
-    else:
-        return [0, top_place, top_rating]
-    
+def get_employment(q_latitude, q_longitude):
+    return score_category('Employment Opportunities', q_latitude, q_longitude)
 
 
 def get_all_scores(q_latitude, q_longitude):
-    print('Enetered All ')
-
     """
     Get all scores based on the queries and the location.
     """
@@ -779,18 +1016,9 @@ def get_all_scores(q_latitude, q_longitude):
     top_places = {}
     top_ratings = {}
     
-    scores['Rental Availability'] = get_rental_availability(q_latitude, q_longitude)
-    scores['Safety'] = get_safety(q_latitude, q_longitude)
-    scores['Connectivity'] = get_connectivity( q_latitude, q_longitude)
-    # scores['Health'] = 5  # Assuming health is always good
-    scores['Entertainment'] = get_entertainment( q_latitude, q_longitude)
-    scores['Education'] = get_education( q_latitude, q_longitude)
-    # scores['Environment'] = get_environment( q_latitude, q_longitude)
-    # scores['Community and Culture'] = get_community( q_latitude, q_longitude)
-    # scores['Digital & Civic Infrastructure'] = get_d_c_infra( q_latitude, q_longitude)
-    # scores['Employment Opportunities'] = get_employment(q_latitude, q_longitude)
-
-
+    # Every enabled category's queries go out at once, so a click costs about
+    # as long as the slowest query chain.
+    scores = score_categories(q_latitude, q_longitude)
 
     for key in scores.keys():
         values = scores.get(key)
@@ -801,35 +1029,290 @@ def get_all_scores(q_latitude, q_longitude):
 
 
     print('new_scores:', new_scores)
-    print('top_places:', top_places)
-    print('top_ratings:', top_ratings)
-    print('Exiting All ')
 
     return new_scores, top_places, top_ratings
 
 
-def ask_google_maps_or_not(client, message):
+async def get_all_scores_async(q_latitude, q_longitude):
+    """get_all_scores for the aio loop."""
+    scores = await score_categories_async(q_latitude, q_longitude)
+
+    new_scores = {key: values[0] for key, values in scores.items()}
+    top_places = {key: values[1] for key, values in scores.items()}
+    top_ratings = {key: values[2] for key, values in scores.items()}
+    print('new_scores:', new_scores)
+
+    return new_scores, top_places, top_ratings
+
+
+def get_scores_batch(points, max_workers=8):
+    """
+    Score many points, yielding (index, result, error) as each one finishes,
+    where result is (scores, top_places, top_ratings) as from get_all_scores.
+
+    Points sharing a query's geohash cell share its search: the first page of
+    every distinct query and cell in the batch is fetched once, before any
+    point is scored. Repeated points are scored once. All of it runs at batch
+    priority: on the batch places pool, and behind interactive calls in the
+    Places rate limiter.
+
+    Parameters:
+        points (list): (lat, lng) pairs.
+        max_workers (int): Points scored at the same time.
+    """
+    _, cutoffs, uncapped = _category_searches(None)
+    api_key = os.getenv('google_place_api_key')
+
+    searches = {}
+    for lat, lng in points:
+        for query_str in cutoffs:
+            key = places_cache_key(query_str, lat, lng)
+            if key not in searches:
+                searches[key] = LazyPlaces(query_str, lat, lng, api_key, use_index=query_str not in uncapped)
+    print(f'Batch of {len(points)} points: {len(searches)} distinct searches')
+
+    with ratelimit.priority_scope(ratelimit.BATCH):
+        futures = [_submit_places(places.prefetch) for places in searches.values()]
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f'Batch prefetch failed, points will retry it: {e}')
+
+    unique_points = {}
+    for index, point in enumerate(points):
+        unique_points.setdefault(tuple(point), []).append(index)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+    try:
+        futures = {_submit_batch(pool, get_all_scores, lat, lng): indexes
+                   for (lat, lng), indexes in unique_points.items()}
+        for future in as_completed(futures):
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, e
+            for index in futures[future]:
+                yield index, result, error
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+llm_cache = LRUCache(max_bytes=int(float(os.getenv('LLM_CACHE_MAX_MB', '16')) * 1024 * 1024),
+                     ttl=float(os.getenv('LLM_CACHE_TTL', str(24 * 3600))))
+
+# Optional on-disk layer behind llm_cache, shared by workers (off unless LLM_STORE_PATH is set).
+_llm_store_path = os.getenv('LLM_STORE_PATH', '')
+llm_store = None
+if _llm_store_path:
+    llm_store = ResultStore(_llm_store_path, table='llm', ttl=float(os.getenv('LLM_CACHE_TTL', str(24 * 3600))))
+
+
+def normalize_prompt(text):
+    """Lower-case and drop punctuation and extra whitespace, so trivially different prompts share a cache entry."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def _llm_cache_key(model, contents, config=None):
+    key = model + '|' + normalize_prompt(contents)
+    if config:
+        key += '|' + repr(sorted((k, getattr(v, '__name__', v)) for k, v in config.items()))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _llm_cached(key):
+    with metrics.span('llm_cache_lookup'):
+        text = llm_cache.get(key)
+        if text is None and llm_store is not None:
+            text = llm_store.get(key)
+            if text is not None:
+                llm_cache.set(key, text)
+    metrics.count_lookup('llm', text is not None)
+    return text
+
+
+def _llm_remember(key, text):
+    if text:
+        llm_cache.set(key, text)
+        if llm_store is not None:
+            llm_store.set(key, text)
+
+
+def _llm_cached_reply(key, parse):
+    text = _llm_cached(key)
+    if text is None or parse is None:
+        return text
+    return parse(text)
+
+
+def _llm_parse_and_remember(key, text, parse):
+    if parse is None:
+        _llm_remember(key, text)
+        return text
+    parsed = parse(text)
+    if parsed is not None:
+        _llm_remember(key, text)
+    return parsed
+
+
+async def _llm_store_call(fn, *args):
+    """fn(*args) for an llm cache helper, in a worker thread when llm_store (SQLite) is on, so the aio loop never waits on it."""
+    if llm_store is None:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+def generate_text(client, contents, model="gemini-2.5-flash", config=None, agent="llm", parse=None):
+    """
+    client.models.generate_content(...).text, answered from llm_cache (then
+    llm_store) when the same normalized prompt was answered before. agent
+    names the call in the llm_agent timing span.
+
+    parse, if given, turns the reply into the return value, or None when the
+    reply is unusable; unusable replies are not cached, and an unusable
+    cached one is asked for again.
+    """
+    key = _llm_cache_key(model, contents, config)
+    cached = _llm_cached_reply(key, parse)
+    if cached is not None:
+        return cached
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents="If the message needs information of something, respond with Yes, else start with No. \n Response should stictly start with Yes or No. " \
+    with metrics.span('llm_agent', agent=agent):
+        if config:
+            response = client.models.generate_content(model=model, contents=contents, config=config)
+        else:
+            response = client.models.generate_content(model=model, contents=contents)
+
+    return _llm_parse_and_remember(key, response.text, parse)
+
+
+async def generate_text_async(client, contents, model="gemini-2.5-flash", config=None, agent="llm", parse=None):
+    """generate_text through the async client (client.aio), for the aio loop."""
+    key = _llm_cache_key(model, contents, config)
+    cached = await _llm_store_call(_llm_cached_reply, key, parse)
+    if cached is not None:
+        return cached
+
+    with metrics.span('llm_agent', agent=agent):
+        if config:
+            response = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+        else:
+            response = await client.aio.models.generate_content(model=model, contents=contents)
+
+    return await _llm_store_call(_llm_parse_and_remember, key, response.text, parse)
+
+
+async def generate_text_stream_async(client, contents, model="gemini-2.5-flash", agent="llm"):
+    """Streaming generate_text_async: a cached answer comes back as one chunk, a new one is cached once complete."""
+    key = _llm_cache_key(model, contents)
+    text = await _llm_store_call(_llm_cached, key)
+    if text is not None:
+        yield text
+        return
+
+    chunks = []
+    with metrics.span('llm_agent', agent=agent):
+        async for chunk in await client.aio.models.generate_content_stream(model=model, contents=contents):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+
+    await _llm_store_call(_llm_remember, key, ''.join(chunks))
+
+
+def _ask_maps_prompt(message):
+    return "If the message needs information of something, respond with Yes, else start with No. \n Response should stictly start with Yes or No. " \
             + "If response starts with no, give explanation and try to help. Keep the response concise. " \
             + "Be supportive and generally answer with a Yes. \n Message: " + message 
-    )
 
-    return response.text
+
+def _rephrase_prompt(message):
+    return "Rephrase the message to be asked to google maps."\
+            + " give only one keyword. " \
+            + "dont use any special character. \n Message: " + message 
+
+
+def ask_google_maps_or_not(client, message):
+
+    return generate_text(client, _ask_maps_prompt(message), agent='ask')
 
 
 def rephrase_ques_for_maps(client, message):
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents="Rephrase the message to be asked to google maps."\
-            + " give only one keyword. " \
-            + "dont use any special character. \n Message: " + message 
-    )
+    return generate_text(client, _rephrase_prompt(message), agent='rephrase')
+
+
+def keyword_from_rephrase(response1):
+    """Pull the keyword out of a rephrase_ques_for_maps reply, which may wrap it in **bold**."""
+    for part in response1.split('**')[:3]:
+        if part.strip():
+            return part.strip()
+    return response1.strip()
+
+
+class MapsPlan(BaseModel):
+    """What the chat should do with a message, from plan_maps_query_async."""
+    needs_maps: bool
+    keyword: Optional[str] = None
+    answer: Optional[str] = None
+
+
+def _plan_prompt(message):
+    return "Decide if the message needs information of some place or thing that google maps can find. " \
+            + "Be supportive and generally set needs_maps to true. " \
+            + "If needs_maps is true, set keyword to one keyword to search on google maps, without any special character. " \
+            + "If needs_maps is false, set answer to a concise explanation that tries to help. \n Message: " + message
+
+_plan_config = {"response_mime_type": "application/json", "response_schema": MapsPlan}
+
+
+def _parse_plan(response_text):
+    """The MapsPlan in a plan_maps_query_async reply, or None if it does not validate."""
+    try:
+        plan = MapsPlan.model_validate_json(response_text or '')
+        if plan.needs_maps and plan.keyword and plan.keyword.strip():
+            plan.keyword = plan.keyword.strip()
+            return plan
+        if not plan.needs_maps and plan.answer:
+            return plan
+    except ValidationError as e:
+        print(f"plan_maps_query_async: invalid reply, falling back to two calls: {e}")
+    return None
+
+
+async def plan_maps_query_async(client, message):
+    """
+    One structured LLM call doing the work of ask_google_maps_or_not and
+    rephrase_ques_for_maps: decide whether the message needs a Google Maps
+    search and, if so, which keyword to search; otherwise answer directly.
+
+    Falls back to the two separate calls if the reply does not validate.
+
+    Returns:
+        MapsPlan
+    """
+
+    plan = await generate_text_async(client, _plan_prompt(message), config=_plan_config, agent='plan',
+                                     parse=_parse_plan)
+    if plan is not None:
+        return plan
+
+    response0 = await generate_text_async(client, _ask_maps_prompt(message), agent='ask')
+    if 'yes' not in response0.lower():
+        return MapsPlan(needs_maps=False, answer=response0)
+    response1 = await generate_text_async(client, _rephrase_prompt(message), agent='rephrase')
+    return MapsPlan(needs_maps=True, keyword=keyword_from_rephrase(response1))
 
-    return response.text
+
+def _maps_answer_prompt(message, context):
+    return ("You are a helpful guide in Bengaluru."
+            + " Use the context to answer the Question."
+            + " Keep the response concise."
+            + " Provide 2 options if possible."
+            + " Context: "+ context
+            # + " chat history: " + str(chat_history['chat_history'])
+            + " Question: "+ message)
 
 
 def respond_to_maps_output(client, message, context):
@@ -837,37 +1320,35 @@ def respond_to_maps_output(client, message, context):
     # print('chat_history:')
     # print(str(chat_history)[:100])
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents="You are a helpful guide in Bengaluru."\
-               + " Use the context to answer the Question."\
-               + " Keep the response concise."\
-               + " Provide 2 options if possible."\
-               + " Context: "+ context \
-            #    + " chat history: " + str(chat_history['chat_history']) \
-               + " Question: "+ message 
-    )
+    return generate_text(client, _maps_answer_prompt(message, context), agent='answer')
+
+
+async def respond_to_maps_output_async(client, message, context):
+
+    return await generate_text_async(client, _maps_answer_prompt(message, context), agent='answer')
 
-    return response.text
 
+async def respond_to_maps_output_stream_async(client, message, context):
+    """Same answer as respond_to_maps_output_async, yielded as text chunks while it is generated."""
 
+    async for chunk in generate_text_stream_async(client, _maps_answer_prompt(message, context), agent='answer'):
+        yield chunk
 
-def formalize_context(places):
+
+
+def formalize_context(places, max_places=CHAT_CONTEXT_PLACES):
 
     context = ''
     iter = 1
 
-    for place in places:
-        context = context + 'Name: ' +str(iter) +' '+ place.get('name', '') \
-                          + 'Type: ' + str(place.get('type', '')) \
-                          + 'Price Level: ' + str(place.get('price_level', '')) \
-                          + 'Over all rating: ' + str(place.get('rating', '')) \
-                          + '# of ratings: ' + str(place.get('user_ratings_total', '')) \
-                          + 'Address: ' + str(place.get('address', ''))+ '. \n'
+    for place in places[:max_places]:
+        context = context + 'Name: ' +str(iter) +' '+ (place.name or '') \
+                          + 'Type: ' + str(getattr(place, 'type', '')) \
+                          + 'Price Level: ' + str(getattr(place, 'price_level', '')) \
+                          + 'Over all rating: ' + str(place.rating) \
+                          + '# of ratings: ' + str(place.user_ratings_total) \
+                          + 'Address: ' + str(place.address)+ '. \n'
         
         iter = iter + 1
 
-        if iter >= 5:
-            break
-
     return context
\ No newline at end of file